@@ -86,7 +86,9 @@ class Chunk(Generic[V]):
         return np.asarray(pos, dtype=int) % self._size
 
     def get_pos(self, pos: Vec3i) -> V:
-        return self.to_array()[tuple(self.inner(pos))]
+        if self._is_filled:  # Do not materialize the array for a single value
+            return self._value
+        return self._value[tuple(self.inner(pos))]
 
     def set_pos(self, pos: Vec3i, value: V):
         inner = self.inner(pos)
@@ -143,10 +145,10 @@ class Chunk(Generic[V]):
     def items(self, mask: Optional["Chunk[bool]"] = None) -> Iterator[Tuple[Vec3i, V]]:
         it = PositionIter(None, None, None, np.zeros(3), self.shape)
         if mask is None:
-            ps = np.asarray(list(it))
+            ps = it.as_array()
         elif isinstance(mask, Chunk):
             m = mask.to_array()
-            ps = np.array([p for p in it if m[p]])
+            ps = it.as_array()[m.astype(bool).ravel()]
         else:
             raise ValueError(f"invalid mask of type {type(mask)}")
         if len(ps) > 0:
@@ -161,7 +163,7 @@ class Chunk(Generic[V]):
         if mask is None:
             if self.is_filled():
                 if self._value:
-                    return np.asarray(list(it)) + self.position_low
+                    return it.as_array() + self.position_low
             else:
                 return np.argwhere(self.to_array().astype(bool)) + self.position_low
         elif isinstance(mask, Chunk):
@@ -169,7 +171,7 @@ class Chunk(Generic[V]):
                 return self.where(mask=None)
             else:
                 m = mask.to_array()
-                return np.array([p for p in it if m[p]]) + self.position_low
+                return it.as_array()[m.astype(bool).ravel()] + self.position_low
         else:
             raise ValueError(f"invalid mask of type {type(mask)}")
         return np.empty((0, 3), dtype=int)
@@ -485,10 +487,10 @@ class Chunk(Generic[V]):
     # TrueDiv Operator
 
     def __truediv__(self, rhs) -> "Chunk[float]":
-        return self.join(rhs, func=operator.truediv, dtype=np.float)
+        return self.join(rhs, func=operator.truediv, dtype=np.float64)
 
     def __itruediv__(self, rhs) -> "Chunk[float]":
-        return self.join(rhs, func=operator.itruediv, dtype=np.float, inplace=True)
+        return self.join(rhs, func=operator.itruediv, dtype=np.float64, inplace=True)
 
     # Reflected Operators
     __radd__ = __add__
@@ -639,7 +641,7 @@ class ChunkGrid(Generic[V]):
         return self.ensure_chunk_at_index(self.chunk_index(pos), insert=insert)
 
     def empty_mask(self, default=False) -> np.ndarray:
-        return np.full(self.chunk_shape, default, dtype=np.bool)
+        return np.full(self.chunk_shape, default, dtype=np.bool_)
 
     @classmethod
     def iter_neighbors_indices(cls, index: ChunkIndex) -> Iterator[Tuple[ChunkFace, Vec3i]]:
@@ -767,7 +769,6 @@ class ChunkGrid(Generic[V]):
     def get_values(self, pos: Union[Sequence[Vec3i], np.ndarray]) -> np.ndarray:
         """Returns a list of values at the positions"""
         # Method cache (prevent lookup in loop)
-        __np_argwhere = np.argwhere
         __self_ensure_chunk_at_index = self.ensure_chunk_at_index
         __chunk_to_array = Chunk.to_array
 
@@ -775,12 +776,18 @@ class ChunkGrid(Generic[V]):
         assert pos.ndim == 2 and pos.shape[1] == 3
         csize = self._chunk_size
         cind, cinv = np.unique(pos // csize, axis=0, return_inverse=True)
+        # Group the positions by chunk with one sort, instead of a full scan per chunk
+        order = np.argsort(cinv, kind='stable')
+        bounds = np.searchsorted(cinv[order], np.arange(len(cind) + 1))
         result = np.zeros(len(cinv), dtype=self._dtype)
-        for n, i in enumerate(cind):
-            pind = __np_argwhere(cinv == n).flatten()
+        for n, i in enumerate(cind.tolist()):
+            pind = order[bounds[n]:bounds[n + 1]]
             cpos = pos[pind] % csize
-            chunk = __self_ensure_chunk_at_index(i, insert=False)
-            result[pind] = __chunk_to_array(chunk)[tuple(cpos.T)]
+            chunk = __self_ensure_chunk_at_index(tuple(i), insert=False)
+            if chunk.is_filled():  # Most lookups outside the model hit filled or missing chunks
+                result[pind] = chunk.value
+            else:
+                result[pind] = __chunk_to_array(chunk)[cpos[:, 0], cpos[:, 1], cpos[:, 2]]
         return result
 
     def get_value(self, pos: Vec3i) -> V:
@@ -805,20 +812,42 @@ class ChunkGrid(Generic[V]):
                     x: Union[int, slice, None] = None,
                     y: Union[int, slice, None] = None,
                     z: Union[int, slice, None] = None):
-        # Variable cache
-        cs = self._chunk_size
-
         it = PositionIter.require_bounded(x, y, z)
+        ia, ja, ka, ua, va, wa = it.arrays()
+        if len(ia) == 0:
+            return  # No Op
 
         if isinstance(value, np.ndarray):
             assert value.shape == it.shape
             if self._dtype is not None:
                 value = value.astype(self._dtype)
-            for i, pos in it.iter_with_indices():
-                self.set_value(pos, value[i])
+            self._set_grouped(np.stack([ua, va, wa], axis=1), value[ia, ja, ka], True)
         else:
-            for pos in it:
-                self.set_value(pos, value)
+            self._set_grouped(np.stack([ua, va, wa], axis=1), value, False)
+
+    def _set_grouped(self, pos: np.ndarray, value: Union[V, np.ndarray], is_array: bool):
+        """
+        Set the values at the positions, writing each touched chunk once
+        :param pos: (N, 3) positions
+        :param value: a single value or (N, ...) values, later positions win on duplicates
+        :param is_array: whether value holds one value per position
+        """
+        # Method cache (prevent lookup in loop)
+        __self_ensure_chunk_at_index = self.ensure_chunk_at_index
+
+        # Variable cache
+        cs = self._chunk_size
+
+        cind, cinv = np.unique(pos // cs, axis=0, return_inverse=True)
+        order = np.argsort(cinv, kind='stable')
+        bounds = np.searchsorted(cinv[order], np.arange(len(cind) + 1))
+        for n, index in enumerate(cind.tolist()):
+            pind = order[bounds[n]:bounds[n + 1]]
+            cpos = pos[pind] % cs
+            chunk = __self_ensure_chunk_at_index(tuple(index))
+            arr = chunk.to_array()
+            arr[cpos[:, 0], cpos[:, 1], cpos[:, 2]] = value[pind] if is_array else value
+            chunk.set_array(arr)
 
     def _set_positions(self, pos: np.ndarray, value: Union[V, Sequence]):
         if isinstance(pos, list):
@@ -833,12 +862,9 @@ class ChunkGrid(Generic[V]):
             assert pos.ndim == 2 and pos.shape[1] == 3, f"shape={pos.shape}"
             if isinstance(value, (list, tuple, np.ndarray)):
                 assert len(pos) == len(value)
-                for p, v in zip(pos, value):
-                    self.set_value(p, v)
+                self._set_grouped(pos, np.asarray(value), True)
             else:
-                upos = np.unique(pos, axis=0)
-                for p in upos:
-                    self.set_value(p, value)
+                self._set_grouped(pos, value, False)
 
     def _set_chunks(self, mask: "ChunkGrid", value: Union[V, np.ndarray, Chunk[V], "ChunkGrid[V]"]):
         assert self._chunk_size == mask._chunk_size
@@ -1178,10 +1204,10 @@ class ChunkGrid(Generic[V]):
     # TrueDiv Operator
 
     def __truediv__(self, rhs: Union["ChunkGrid[V]", np.ndarray, V]) -> "ChunkGrid[float]":
-        return self.outer_join(rhs, func=operator.truediv, dtype=np.float)
+        return self.outer_join(rhs, func=operator.truediv, dtype=np.float64)
 
     def __itruediv__(self, rhs: Union["ChunkGrid[V]", np.ndarray, V]) -> "ChunkGrid[float]":
-        return self.outer_join(rhs, func=operator.itruediv, dtype=np.float, inplace=True)
+        return self.outer_join(rhs, func=operator.itruediv, dtype=np.float64, inplace=True)
 
     # Reflected Operators
     __radd__ = __add__
@@ -1,3 +1,4 @@
+import functools
 from typing import Union, Tuple, Iterator, Optional, Iterable, Callable
 
 import numpy as np
@@ -20,8 +21,16 @@ def ceildiv(a, b):
     return -(-a // b)
 
 
+def _readonly_vec(values) -> np.ndarray:
+    """Int array copy that is safe to share between callers"""
+    arr = np.array(values, dtype=int)
+    arr.flags.writeable = False
+    return arr
+
+
 class ValueIter:
     """1D Slice Iterator"""
+    __slots__ = ["_low", "_high", "_slice", "_start", "_stop", "_step", "clip"]
 
     @classmethod
     def _indices(cls, s: slice, low: int, high: int, clip=True) -> Tuple[int, int, int]:
@@ -48,9 +57,16 @@ class ValueIter:
 
     def __contains__(self, item) -> bool:
         if isinstance(item, int):
-            return self._start <= item < self._stop and (item % self._step) == (self._start % self._step)
+            d = item - self._start
+            return d >= 0 and item < self._stop and d % self._step == 0
         return False
 
+    def contains_array(self, arr: np.ndarray) -> np.ndarray:
+        """Vectorized __contains__, returns a bool mask with the shape of arr"""
+        arr = np.asarray(arr)
+        d = arr - self._start
+        return (d >= 0) & (arr < self._stop) & (d % self._step == 0)
+
     def __iter__(self) -> Iterator[int]:
         yield from range(self._start, self._stop, self._step)
 
@@ -97,6 +113,7 @@ class ValueIter:
 
 class PositionIter:
     """3D Slice Iterator"""
+    __slots__ = ["_low", "_high", "_x", "_y", "_z", "_start", "_stop", "_step", "clip"]
 
     @classmethod
     def require_bounded(cls, x: SliceOpt, y: SliceOpt, z: SliceOpt) -> "PositionIter":
@@ -112,13 +129,22 @@ class PositionIter:
     def empty(cls) -> "PositionIter":
         return cls(0, 0, 0, np.zeros(3), np.zeros(3))
 
+    @classmethod
+    def cached(cls, x: SliceOpt, y: SliceOpt, z: SliceOpt, low: Vec3i, high: Vec3i) -> "PositionIter":
+        """Same as the constructor, but repeated calls with equal arguments share one read-only instance"""
+        return _cached_position_iter(_slice_key(x), _slice_key(y), _slice_key(z),
+                                     tuple(int(i) for i in low), tuple(int(i) for i in high))
+
     def __init__(self, x: SliceOpt, y: SliceOpt, z: SliceOpt, low: Vec3i, high: Vec3i, clip=True):
-        self._low = np.asarray(low, dtype=int)
-        self._high = np.asarray(high, dtype=int)
+        self._low = _readonly_vec(low)
+        self._high = _readonly_vec(high)
         assert self._low.shape == (3,) and self._high.shape == (3,)
         self._x = ValueIter(x, self._low[0], self._high[0], clip)
         self._y = ValueIter(y, self._low[1], self._high[1], clip)
         self._z = ValueIter(z, self._low[2], self._high[2], clip)
+        self._start = _readonly_vec((self._x.start, self._y.start, self._z.start))
+        self._stop = _readonly_vec((self._x.stop, self._y.stop, self._z.stop))
+        self._step = _readonly_vec((self._x.step, self._y.step, self._z.step))
         self.clip = clip
 
     def __contains__(self, item: Vec3i) -> bool:
@@ -126,17 +152,41 @@ class PositionIter:
             return item[0] in self._x and item[1] in self._y and item[2] in self._z
         return False
 
+    def contains_array(self, arr: np.ndarray) -> np.ndarray:
+        """Vectorized __contains__ for a (N, 3) array of positions, returns a (N,) bool mask"""
+        arr = np.asarray(arr)
+        assert arr.ndim == 2 and arr.shape[1] == 3
+        return self._x.contains_array(arr[:, 0]) & self._y.contains_array(arr[:, 1]) \
+               & self._z.contains_array(arr[:, 2])
+
     def iter_with_indices(self) -> Iterator[Tuple[Index, Index]]:
         for i, u in enumerate(self._x.range()):
             for j, v in enumerate(self._y.range()):
                 for k, w in enumerate(self._z.range()):
                     yield (i, j, k), (u, v, w)
 
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Flat index arrays (i, j, k, u, v, w), vectorized counterpart of iter_with_indices()
+        :return: offsets (i, j, k) into the iterated block and matching positions (u, v, w)
+        """
+        xs = np.arange(self._x.start, self._x.stop, self._x.step, dtype=int)
+        ys = np.arange(self._y.start, self._y.stop, self._y.step, dtype=int)
+        zs = np.arange(self._z.start, self._z.stop, self._z.step, dtype=int)
+        i, j, k = (a.ravel() for a in np.indices((len(xs), len(ys), len(zs))))
+        return i, j, k, xs[i], ys[j], zs[k]
+
+    def as_array(self) -> np.ndarray:
+        """All positions as (N, 3) array in the same order as the iterator"""
+        xs = np.arange(self._x.start, self._x.stop, self._x.step, dtype=np.int32)
+        ys = np.arange(self._y.start, self._y.stop, self._y.step, dtype=np.int32)
+        zs = np.arange(self._z.start, self._z.stop, self._z.step, dtype=np.int32)
+        i, j, k = np.meshgrid(xs, ys, zs, indexing='ij')
+        return np.stack([i.ravel(), j.ravel(), k.ravel()], axis=1)
+
     def __iter__(self) -> Iterator[Index]:
-        for u in self._x.range():
-            for v in self._y.range():
-                for w in self._z.range():
-                    yield u, v, w
+        # tolist() converts to python ints in one pass, which are cheaper to hash than numpy scalars
+        return map(tuple, self.as_array().tolist())
 
     def __len__(self):
         return len(self._x) * len(self._y) * len(self._z)
@@ -167,15 +217,15 @@ class PositionIter:
 
     @property
     def start(self) -> Vec3i:
-        return np.asarray((self._x.start, self._y.start, self._z.start), dtype=int)
+        return self._start
 
     @property
     def stop(self) -> Vec3i:
-        return np.asarray((self._x.stop, self._y.stop, self._z.stop), dtype=int)
+        return self._stop
 
     @property
     def step(self) -> Vec3i:
-        return np.asarray((self._x.step, self._y.step, self._z.step), dtype=int)
+        return self._step
 
     def __floordiv__(self, other):
         x = self._x // other
@@ -189,36 +239,73 @@ class PositionIter:
         )
 
 
+def _slice_key(s: SliceOpt) -> Union[int, None, Tuple[Optional[int], Optional[int], Optional[int]]]:
+    """Hashable representation of a slice option"""
+    if isinstance(s, slice):
+        return s.start, s.stop, s.step
+    return s
+
+
+@functools.lru_cache(maxsize=128)
+def _cached_position_iter(x, y, z, low: Index, high: Index) -> PositionIter:
+    def _slice(k) -> SliceOpt:
+        return slice(*k) if isinstance(k, tuple) else k
+
+    return PositionIter(_slice(x), _slice(y), _slice(z), low, high)
+
+
 class MinMaxCheck:
     """3D minmax check"""
-    __slots__ = ["_min", "_max", "_dirty"]
+    __slots__ = ["_min_x", "_min_y", "_min_z", "_max_x", "_max_y", "_max_z", "_has", "_dirty"]
 
     def __init__(self):
-        self._min: Optional[Index] = None
-        self._max: Optional[Index] = None
-        self._dirty = False
+        self.clear()
 
     def clear(self):
-        self._min = None
-        self._max = None
+        self._min_x = self._min_y = self._min_z = 0
+        self._max_x = self._max_y = self._max_z = 0
+        self._has = False
         self._dirty = False
 
     def update(self, other: Union[Iterable[Index]]):
-        indices = np.array(list(other))
-        assert len(indices) > 0
-        self._min = tuple(np.min(indices, axis=0))
-        self._max = tuple(np.max(indices, axis=0))
+        # Transpose to per-axis tuples, so no intermediate list or array of all indices is built
+        axes = tuple(zip(*other))
+        assert len(axes) == 3
+        xs, ys, zs = axes
+        self._min_x, self._min_y, self._min_z = int(min(xs)), int(min(ys)), int(min(zs))
+        self._max_x, self._max_y, self._max_z = int(max(xs)), int(max(ys)), int(max(zs))
+        self._has = True
         self._dirty = False
 
     def add(self, index: Index):
-        if self._min is None:
-            self._min = tuple(np.asarray(index, dtype=int))
+        x, y, z = int(index[0]), int(index[1]), int(index[2])
+        if not self._has:
+            self._min_x, self._min_y, self._min_z = x, y, z
+            self._max_x, self._max_y, self._max_z = x, y, z
+            self._has = True
         else:
-            self._min = tuple(np.min((self._min, index), axis=0))
-        if self._max is None:
-            self._max = tuple(np.asarray(index, dtype=int))
-        else:
-            self._max = tuple(np.max((self._max, index), axis=0))
+            if x < self._min_x:
+                self._min_x = x
+            elif x > self._max_x:
+                self._max_x = x
+            if y < self._min_y:
+                self._min_y = y
+            elif y > self._max_y:
+                self._max_y = y
+            if z < self._min_z:
+                self._min_z = z
+            elif z > self._max_z:
+                self._max_z = z
+
+    def remove(self, index: Index):
+        """Only invalidates the bounds if the removed index lies on them"""
+        if self._dirty or not self._has:
+            return
+        x, y, z = index
+        if (x == self._min_x or x == self._max_x
+                or y == self._min_y or y == self._max_y
+                or z == self._min_z or z == self._max_z):
+            self._dirty = True
 
     @property
     def dirty(self):
@@ -228,18 +315,21 @@ class MinMaxCheck:
         self._dirty = True
 
     @property
-    def min(self):
+    def min(self) -> Optional[Index]:
         assert not self._dirty
-        return self._min
+        if self._has:
+            return self._min_x, self._min_y, self._min_z
+        return None
 
     @property
-    def max(self):
+    def max(self) -> Optional[Index]:
         assert not self._dirty
-        return self._max
+        if self._has:
+            return self._max_x, self._max_y, self._max_z
+        return None
 
     def get(self) -> Tuple[Index, Index]:
-        assert not self._dirty
-        return self._min, self._max
+        return self.min, self.max
 
     def safe(self, getter: Callable[[], Union[Iterable[Index]]]) -> Tuple[Index, Index]:
         if self._dirty:
@@ -37,10 +37,10 @@ class ChunkFace(enum.IntEnum):
         return CHUNK_DIRECTIONS[self]
 
     def _flip(self) -> int:
-        return (self // 2) * 2 + ((self + 1) % 2)
+        return self ^ 1  # Faces come in opposing pairs (0, 1), (2, 3), (4, 5)
 
     def flip(self) -> "ChunkFace":
-        return ChunkFace(self._flip())
+        return CHUNK_FLIP[self]
 
     def slice(self, width: int = -1, other: Optional[slice] = None) -> Tuple[Union[int, slice], ...]:
         _other_none = other is None
@@ -108,3 +108,7 @@ class ChunkFace(enum.IntEnum):
     @classmethod
     def corner_direction(cls, x: "ChunkFace", y: "ChunkFace", z: "ChunkFace") -> Vec3i:
         return x.direction() + y.direction() + z.direction()
+
+
+# Static flipped faces, lookup is cheaper than constructing the enum
+CHUNK_FLIP = tuple(ChunkFace(f._flip()) for f in ChunkFace)
@@ -10,6 +10,8 @@ T = TypeVar('T')
 Index = Tuple[int, int, int]
 IndexUnion = Union[Index, Sequence[int], np.ndarray]
 
+_INT = np.int64
+
 
 class IndexDict(Generic[T]):
     """
@@ -30,55 +32,63 @@ class IndexDict(Generic[T]):
     def __delitem__(self, key):
         index = self.index(key)
         del self._data[index]
-        self._minmax.set_dirty()
+        self._minmax.remove(index)
 
     def pop(self, index, default=None) -> Optional[T]:
+        index = self.index(index)
         l = len(self._data)
         c = self._data.pop(index, default)
         if l != len(self._data):
-            self._minmax.set_dirty()
+            self._minmax.remove(index)
         return c
 
     def minmax(self, asarray=False) -> Tuple[Vec3i, Vec3i]:
         """ Returns the min and max index of all contained indices"""
         if asarray:
             # noinspection PyTypeChecker
-            return np.asarray(self._minmax.safe(self._data.keys), dtype=int)
+            return np.asarray(self._minmax.safe(self._data.keys), dtype=_INT)
         return self._minmax.safe(self._data.keys)
 
     def size(self) -> Vec3i:
         if self._data:
             min, max = self.minmax(True)
             return max - min + 1
-        return np.zeros(3, dtype=int)
+        return np.zeros(3, dtype=_INT)
 
     @classmethod
     def index(cls, item: IndexUnion) -> Index:
-        item = np.asarray(item, dtype=int)
+        # Fast path for the common case of a tuple of python ints
+        if type(item) is tuple and len(item) == 3:
+            a, b, c = item
+            if type(a) is int and type(b) is int and type(c) is int:
+                return item
+        item = np.asarray(item, dtype=_INT)
         if item.shape != (3,):
             raise IndexError(f"Invalid index {item}")
-        return tuple(item)
+        return int(item[0]), int(item[1]), int(item[2])
 
     def get(self, index: Index, default=None) -> Optional[T]:
         return self._data.get(self.index(index), default)
 
     def __getitem_from_numpy(self, item: np.ndarray, ignore_empty=True) -> Union[T, List[T]]:
-        item = np.asarray(item, dtype=int)
+        item = np.asarray(item, dtype=_INT)
         if item.shape == (3,):
-            return self._data[tuple(item)]
+            return self._data[tuple(item.tolist())]
         else:
             assert item.ndim == 2 and item.shape[1] == 3
+            # Convert all rows at once to python ints, which are cheaper to build and hash than numpy rows
+            keys = map(tuple, item.tolist())
             if ignore_empty:
-                return [d for d in (self._data.get(tuple(i), None) for i in item) if d is not None]
+                return [d for d in map(self._data.get, keys) if d is not None]
             else:
-                return [self._data[tuple(i)] for i in item]
+                return [self._data[k] for k in keys]
 
     def sliced_iterator(self, x: Union[int, slice, None] = None, y: Union[int, slice, None] = None,
                         z: Union[int, slice, None] = None) -> PositionIter:
         if not self._data:
             return PositionIter.empty()
-        k_min, k_max = self.minmax(True)
-        return PositionIter(x, y, z, low=k_min, high=k_max + 1)
+        k_min, k_max = self._minmax.safe(self._data.keys)
+        return PositionIter.cached(x, y, z, low=k_min, high=(k_max[0] + 1, k_max[1] + 1, k_max[2] + 1))
 
     def sliced(self, x: Union[int, slice, None] = None, y: Union[int, slice, None] = None,
                z: Union[int, slice, None] = None, ignore_empty=True) -> Iterator[T]:
@@ -88,20 +98,31 @@ class IndexDict(Generic[T]):
             yield from self._data.values()
         else:
             it = self.sliced_iterator(x, y, z)
+            # Method cache (prevent lookup in loop)
+            __data_get = self._data.get
             if ignore_empty:
                 for key in it:
-                    if key in self._data:
-                        yield self._data[key]
+                    c = __data_get(key, None)
+                    if c is not None:
+                        yield c
             else:
                 for key in it:
-                    yield self._data.get(key)
+                    yield __data_get(key)
 
     def __getitem__(self, item: Union[IndexUnion, slice, Tuple[slice, ...]]) -> Union[T, List[T]]:
+        # Fast paths on the exact type, before the generic isinstance dispatch below
+        t = type(item)
+        if t is tuple and len(item) == 3:
+            a, b, c = item
+            if type(a) is int and type(b) is int and type(c) is int:
+                return self._data[item]
+        elif t is np.ndarray:
+            return self.__getitem_from_numpy(item)
         if isinstance(item, slice):
             return list(self.sliced(item))
         if isinstance(item, tuple):
             try:
-                index = np.asarray(item, dtype=int)
+                index = np.asarray(item, dtype=_INT)
                 if index.shape == (3,):
                     return self._data[self.index(item)]
                 raise KeyError(f"invalid key {item}")
@@ -111,7 +132,7 @@ class IndexDict(Generic[T]):
                 return list(self.sliced(*item))
             raise KeyError(f"invalid key {item}")
         elif isinstance(item, (list, np.ndarray)):
-            return self.__getitem_from_numpy(np.array(item, dtype=int))
+            return self.__getitem_from_numpy(np.array(item, dtype=_INT))
         else:
             raise KeyError(f"invalid key {item}")
 
@@ -313,3 +313,66 @@ def flood_fill_at(position: Vec3i, mask: ChunkGrid, max_steps: Optional[int] = N
     image = ChunkGrid(mask.chunk_size, b8, False)
     image[position] = True
     return flood_fill(image, mask, max_steps, verbose=verbose, **kwargs)
+
+
+def label_components(mask: ChunkGrid[bool]) -> Tuple[ChunkGrid[np.int32], int]:
+    """
+    Label the 6-connected components of a mask, like ndimage.label but chunk by chunk.
+    Each chunk is labeled on its own and the labels that touch across chunk faces are merged afterwards.
+    :param mask: voxel mask, its fill value must be False
+    :return: the label grid (0 is background) and the number of components
+    """
+    assert not mask.fill_value
+    labels: ChunkGrid[np.int32] = ChunkGrid(mask.chunk_size, np.int32, 0)
+
+    # Label each chunk with globally unique labels
+    count = 0
+    for index, c in mask.chunks.items():
+        if c.is_filled():
+            if c.value:
+                count += 1
+                labels.ensure_chunk_at_index(index).set_fill(count)
+        else:
+            arr, n = ndimage.label(c.to_array())
+            if n > 0:
+                arr[arr > 0] += count
+                count += n
+                labels.ensure_chunk_at_index(index).set_array(arr)
+
+    # Merge labels that touch at the faces between neighboring chunks
+    parent = list(range(count + 1))
+
+    def find(a: int) -> int:
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    # Method cache (prevent lookup in loop)
+    __labels_chunks_get = labels.chunks.get
+
+    for index, c in labels.chunks.items():
+        arr = c.to_array()
+        for f in (ChunkFace.NORTH, ChunkFace.TOP, ChunkFace.EAST):
+            other = __labels_chunks_get(np.add(index, f.direction()), None)
+            if other is None:
+                continue
+            a = arr[f.slice()]
+            b = other.to_array()[f.flip().slice()]
+            touch = (a > 0) & (b > 0)
+            if touch.any():
+                for u, v in np.unique(np.stack((a[touch], b[touch]), axis=1), axis=0).tolist():
+                    u, v = find(u), find(v)
+                    if u != v:
+                        parent[max(u, v)] = min(u, v)
+
+    # Renumber the merged labels consecutively
+    roots = np.array([find(i) for i in range(count + 1)], dtype=np.int32)
+    uniq, relabel = np.unique(roots, return_inverse=True)
+    relabel = relabel.astype(np.int32)
+    for c in labels.chunks:
+        if c.is_filled():
+            c.set_fill(relabel[c.value])
+        else:
+            c.set_array(relabel[c.to_array()])
+    return labels, len(uniq) - 1
@@ -63,3 +63,39 @@ def angle_between(a: np.ndarray, b: np.ndarray):
 @numba.njit(fastmath=True, inline='always')
 def angle_between_normals(a: np.ndarray, b: np.ndarray):
     return np.arccos(np.dot(a, b))
+
+
+def _split_bits3(v: np.ndarray) -> np.ndarray:
+    """Spread the lower 21 bits of each value, so that two zero bits follow each bit"""
+    v = v.astype(np.uint64) & np.uint64(0x1fffff)
+    v = (v | v << np.uint64(32)) & np.uint64(0x1f00000000ffff)
+    v = (v | v << np.uint64(16)) & np.uint64(0x1f0000ff0000ff)
+    v = (v | v << np.uint64(8)) & np.uint64(0x100f00f00f00f00f)
+    v = (v | v << np.uint64(4)) & np.uint64(0x10c30c30c30c30c3)
+    v = (v | v << np.uint64(2)) & np.uint64(0x1249249249249249)
+    return v
+
+
+def morton_code(points: np.ndarray) -> np.ndarray:
+    """
+    Z-order (Morton) code of non-negative integer 3D points, up to 21 bits per axis.
+    The x-axis is the most and the z-axis the least significant, matching the C-order of arrays.
+    :param points: (N, 3) integer array
+    :return: (N,) uint64 codes
+    """
+    points = np.asarray(points)
+    return (_split_bits3(points[:, 0]) << np.uint64(2)) | (_split_bits3(points[:, 1]) << np.uint64(1)) \
+           | _split_bits3(points[:, 2])
+
+
+def morton_order(points: Union[np.ndarray, Sequence[Vec3i]]) -> np.ndarray:
+    """
+    Permutation that sorts integer 3D points (e.g. chunk indices) along the Z-order curve, which keeps
+    neighboring points close to each other in the iteration order.
+    :param points: (N, 3) integer points, may be negative
+    :return: (N,) indices into points
+    """
+    points = np.asarray(points, dtype=np.int64).reshape((-1, 3))
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.argsort(morton_code(points - points.min(axis=0)), kind='stable')
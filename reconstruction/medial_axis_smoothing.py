@@ -147,7 +147,7 @@ def propagate_normals(iterations: int, values: ChunkGrid[Vec3f], fixed: ChunkGri
 
     # Find indices where to operate
     indices_offset = fixed.chunks.minmax()[0]
-    indices = [tuple(i) for i in np.array(list(np.ndindex(*fixed.chunks.size())), dtype=np.int) + indices_offset]
+    indices = [tuple(i) for i in np.array(list(np.ndindex(*fixed.chunks.size())), dtype=np.int64) + indices_offset]
     indices = set(i for i in indices if mask.ensure_chunk_at_index(i, insert=False).any())
 
     size = values.chunk_size
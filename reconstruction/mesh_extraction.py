@@ -1,7 +1,8 @@
 """
 Mesh extractions from voxels
 """
-from typing import Tuple, List, Set, Dict
+import itertools
+from typing import Tuple, List, Sequence, Optional
 
 import numba
 import numpy as np
@@ -10,7 +11,7 @@ from pytorch3d.structures import Meshes
 
 from reconstruction.data.chunks import ChunkGrid, ChunkFace
 from reconstruction.filters.normals import grid_normals
-from reconstruction.mathlib import Vec3i
+from reconstruction.mathlib import Vec3i, morton_order
 from reconstruction.mincut import MinCut
 from reconstruction.render import voxel_render
 
@@ -19,11 +20,6 @@ numba.config.THREADING_LAYER = 'omp'
 NodeIndex = Tuple[Vec3i, ChunkFace]
 
 
-@numba.stencil(cval=0)
-def _sum_block222(a):
-    return (a[0, 0, 0] + a[0, 0, 1] + a[0, 1, 0] + a[0, 1, 1] + a[1, 0, 0] + a[1, 0, 1] + a[1, 1, 0] + a[1, 1, 1])
-
-
 CutEdge = int
 CutEdge_X = 1
 CutEdge_Y = 2
@@ -76,22 +72,6 @@ def _any_edge(edge: int):
     return 0
 
 
-@numba.njit(fastmath=True)
-def _iter_block_neighbors(pos: Vec3i):
-    n = _block_pos_to_idx(pos)
-    for i in range(8):
-        idx = n + i
-        p = _block_idx_to_pos(idx)
-        if _is_block_neighbor(pos, p):
-            yield p
-
-
-@numba.njit(fastmath=True, inline='always')
-def _is_edge_neighbor(edge: int, a: Vec3i, b: Vec3i):
-    idx = edge >> 1
-    return a[idx] == b[idx]
-
-
 @numba.njit(fastmath=True)
 def _block_pos_to_idx(pos: Vec3i) -> int:
     return pos[0] | pos[1] << 1 | pos[2] << 2
@@ -102,6 +82,32 @@ def _block_idx_to_pos(idx: int) -> Vec3i:
     return (idx & 1, (idx >> 1) & 1, (idx >> 2) & 1)
 
 
+def _make_block_edge_neighbors() -> np.ndarray:
+    """
+    Build the static lookup table of voxels that can share a cut edge with a voxel of a 2x2x2 block.
+    These are the direct and edge neighbors with the same coordinate along the edge axis (CutEdge >> 1).
+    :return: (8, 3, 3) array of block indices, indexed by the block index of the voxel and the edge axis
+    """
+    table = np.empty((8, 3, 3), dtype=np.int64)
+    for n in range(8):
+        a = (n & 1, (n >> 1) & 1, (n >> 2) & 1)
+        for axis in range(3):
+            neighbors = []
+            for i in range(1, 8):  # Scan order starts after the voxel itself
+                m = (n + i) & 7
+                b = (m & 1, (m >> 1) & 1, (m >> 2) & 1)
+                dist = abs(b[0] - a[0]) + abs(b[1] - a[1]) + abs(b[2] - a[2])
+                if a[axis] == b[axis] and (dist == 1 or dist == 2):
+                    neighbors.append(m)
+            table[n, axis] = neighbors
+    return table
+
+
+_BLOCK_EDGE_NEIGHBORS = _make_block_edge_neighbors()
+# Upper bound for the steps of a face walk, each of the 8 voxels can be left over each of its 3 cut edge axes
+_MAX_FACE_STEPS = 8 * 3
+
+
 @numba.njit(fastmath=True)
 def _sum_normals(normals: np.ndarray, mask: np.ndarray):
     result = np.zeros((3,), dtype=np.float32)
@@ -134,20 +140,25 @@ def _make_face(block: np.ndarray, cut_edges: np.ndarray, normals: np.ndarray):
     pos = pos0
     edge = edge0
     visited: List[Vec3i] = [pos]
+    steps = 0
     while True:
+        steps += 1
+        if steps > _MAX_FACE_STEPS:  # The walk is cycling without reaching the first voxel again
+            raise RuntimeError("Face walk did not close")
         edge1 = _any_edge(cut_edges[pos] & ~edge)  # Find the second cut edge f in v
         assert edge1 != CutEdge_NONE
         found = False
+        neighbors = _BLOCK_EDGE_NEIGHBORS[_block_pos_to_idx(pos), edge1 >> 1]
         for repeat in range(2):
-            for pos1 in _iter_block_neighbors(pos):  # Find the neigboring voxel w
+            for n in neighbors:  # Find the neigboring voxel w
+                pos1 = _block_idx_to_pos(n)
                 if repeat == 1 or pos1 not in visited:
-                    if _is_edge_neighbor(edge1, pos, pos1):
-                        if block[pos1] and cut_edges[pos1] & edge1:  # that shares the cut-edge
-                            visited.append(pos)  # generate a polygon edge from v to w
-                            pos = pos1  # v <- w
-                            edge = edge1  # e <- f
-                            found = True
-                            break
+                    if block[pos1] and cut_edges[pos1] & edge1:  # that shares the cut-edge
+                        visited.append(pos)  # generate a polygon edge from v to w
+                        pos = pos1  # v <- w
+                        edge = edge1  # e <- f
+                        found = True
+                        break
             if found:
                 break
 
@@ -180,35 +191,118 @@ def _make_face(block: np.ndarray, cut_edges: np.ndarray, normals: np.ndarray):
     return verts, faces
 
 
+def _corner_cut_edges(sopt: np.ndarray, segments: np.ndarray) -> np.ndarray:
+    """
+    Compute the cut edges of all voxels in a single vectorized pass, as _detect_cut_edges does per 2x2x2 block.
+    The faces tested for a voxel depend on its corner in the block, so there is one result per corner.
+    :param sopt: boolean voxel array
+    :param segments: voxel array with the segment of each of the 6 octahedron nodes
+    :return: (8, X, Y, Z) bit-mask array of CutEdge, indexed by the block index of the corner (see _block_pos_to_idx)
+    """
+    result = np.empty((8, *sopt.shape), dtype=np.int8)
+    for x, y, z in itertools.product((0, 1), repeat=3):
+        fx = segments[..., ChunkFace.NORTH + x]
+        fy = segments[..., ChunkFace.TOP + y]
+        fz = segments[..., ChunkFace.EAST + z]
+        cut = ((fx != fy) * CutEdge_Z) | ((fx != fz) * CutEdge_Y) | ((fy != fz) * CutEdge_X)
+        result[x | y << 1 | z << 2] = np.where(sopt, cut, CutEdge_NONE)
+    return result
+
+
+def _candidate_blocks(corner_cuts: np.ndarray) -> np.ndarray:
+    """
+    Find the 2x2x2 blocks that can produce a face, in a single vectorized pass over the array.
+    A block needs at least 3 voxels of sopt that have a cut edge.
+    :param corner_cuts: cut edges per corner (see _corner_cut_edges)
+    :return: (N, 3) array of block positions (lower corners)
+    """
+    sx, sy, sz = (s - 1 for s in corner_cuts.shape[1:])
+    count = np.zeros((sx, sy, sz), dtype=np.int8)
+    for x, y, z in itertools.product((0, 1), repeat=3):
+        count += corner_cuts[x | y << 1 | z << 2, x:x + sx, y:y + sy, z:z + sz] != CutEdge_NONE
+    return np.argwhere(count >= 3)
+
+
 @numba.njit(fastmath=True)
-def _extract_polygon_edges(sopt: np.ndarray, segments: np.ndarray, normals: np.ndarray) \
-        -> List[Tuple[np.ndarray, np.ndarray]]:
-    detected = _sum_block222(sopt)
-    result: List[Tuple[np.ndarray, np.ndarray]] = []
-    for pos in np.argwhere(detected >= 3):
+def _extract_polygon_edges(sopt: np.ndarray, corner_cuts: np.ndarray, normals: np.ndarray, candidates: np.ndarray) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Make the faces of all candidate blocks
+    :return: vertices and triangles of all faces, collected in flat arrays
+    """
+    capacity = 8 * max(1, len(candidates))
+    verts = np.empty((capacity, 3), dtype=np.int32)
+    faces = np.empty((capacity, 3), dtype=np.uint32)
+    cut_edges = np.empty((2, 2, 2), dtype=np.int8)
+    nv = 0
+    nf = 0
+    for pos in candidates:
         x, y, z = pos
         sopt_block = sopt[x:x + 2, y:y + 2, z:z + 2]
-        cut_edges = _detect_cut_edges(sopt_block, segments[x:x + 2, y:y + 2, z:z + 2])
+        # Gather the precomputed cut edges of each corner
+        for n in range(8):
+            bx, by, bz = _block_idx_to_pos(n)
+            cut_edges[bx, by, bz] = corner_cuts[n, x + bx, y + by, z + bz]
         normals_block = normals[x:x + 2, y:y + 2, z:z + 2]
         v, f = _make_face(sopt_block, cut_edges, normals_block)
         if len(v) > 0:
-            result.append((v + pos, f))
-
-    # Fallback, empty result
+            # Grow geometrically when a block produced more vertices than reserved
+            while nv + len(v) > len(verts) or nf + len(f) > len(faces):
+                verts = np.concatenate((verts, np.empty_like(verts)))
+                faces = np.concatenate((faces, np.empty_like(faces)))
+            verts[nv:nv + len(v)] = v + pos
+            faces[nf:nf + len(f)] = f + nv
+            nv += len(v)
+            nf += len(f)
+    return verts[:nv], faces[:nf]
+
+
+def node_segment_volume(nodes: Sequence[NodeIndex], segments: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Scatter the mincut segments into a dense volume, so they can be looked up by slicing instead of per node.
+    Nodes only use positive-direction faces (see MinCut.get_node), so 3 entries per voxel are sufficient.
+    :param nodes: the mincut nodes
+    :param segments: the segment of each node
+    :return: int8 volume (X, Y, Z, 3) with the segment per positive face axis (-1 for missing nodes), and its offset
+    """
+    pos = np.array([p for p, _ in nodes], dtype=int)
+    axis = np.array([f for _, f in nodes], dtype=int) // 2
+    low = pos.min(axis=0)
+    pos -= low
+    volume = np.full((*(pos.max(axis=0) + 1), 3), -1, dtype=np.int8)
+    volume[pos[:, 0], pos[:, 1], pos[:, 2], axis] = segments
+    return volume, low
+
+
+def _crop(volume: np.ndarray, start: Vec3i, shape: Vec3i, fill_value) -> np.ndarray:
+    """Copy a block of the volume, parts outside of the volume are filled with fill_value"""
+    start = np.asarray(start, dtype=int)
+    result = np.full((*shape, *volume.shape[3:]), fill_value, dtype=volume.dtype)
+    src_min = np.maximum(start, 0)
+    src_max = np.minimum(start + shape, volume.shape[:3])
+    if np.all(src_max > src_min):
+        dst_min = src_min - start
+        dst_max = dst_min + (src_max - src_min)
+        result[tuple(slice(a, b) for a, b in zip(dst_min, dst_max))] = \
+            volume[tuple(slice(a, b) for a, b in zip(src_min, src_max))]
     return result
 
 
-def extract_voxel_segments(nodes_index: Dict[NodeIndex, int], segments: np.ndarray, sopt: np.ndarray, offset: Vec3i):
+def extract_voxel_segments(volume: np.ndarray, volume_offset: Vec3i, sopt: np.ndarray, offset: Vec3i):
     """Compute segment for each voxel in sopt"""
-    _get_node = MinCut.get_node
-    start = np.asanyarray(offset)
-    result = np.zeros((*sopt.shape, 6), dtype=np.bool8)
-    for p in np.argwhere(sopt):
-        pos = start + p
-        tpos = tuple(pos)
-        value = [segments[nodes_index[_get_node(tpos, f)]] for f in ChunkFace]
-        assert any(value)  # Make sure that the segment is valid!
-        result[p[0], p[1], p[2], :] = value
+    start = np.asarray(offset, dtype=int) - volume_offset
+    # One voxel margin at the low end for the negative-direction faces, which are stored at the previous voxel
+    block = _crop(volume, start - 1, tuple(s + 1 for s in sopt.shape), -1)
+    inner = block[1:, 1:, 1:]
+    segs = np.empty((*sopt.shape, 6), dtype=np.int8)
+    segs[..., ChunkFace.NORTH] = inner[..., 0]
+    segs[..., ChunkFace.SOUTH] = block[:-1, 1:, 1:, 0]
+    segs[..., ChunkFace.TOP] = inner[..., 1]
+    segs[..., ChunkFace.BOTTOM] = block[1:, :-1, 1:, 1]
+    segs[..., ChunkFace.EAST] = inner[..., 2]
+    segs[..., ChunkFace.WEST] = block[1:, 1:, :-1, 2]
+    result = (segs == 1) & sopt[..., None].astype(np.bool8)
+    assert np.all(result[sopt].any(axis=1))  # Make sure that the segment is valid!
     return result
 
 
@@ -226,29 +320,37 @@ class MeshExtraction:
 
         size = sopt.chunk_size
 
-        # Cache mincut segments
-        segments = self.mincut.segments()
-        nodes_index = self.mincut.nodes_index
+        # Cache mincut segments as dense volume
+        segment_volume, segment_offset = node_segment_volume(self.mincut.nodes, self.mincut.segments())
 
         # Approximate surface normals via outer segment
         normals = grid_normals(sopt, outer=self.segment0)
 
+        # Visit the chunks along the Z-order curve, so that neighboring chunks are processed close together
+        indices = list(sopt.chunks.keys())
         result: List[Tuple[np.ndarray, np.ndarray]] = []
-        for index in sopt.chunks.keys():
+        for index in (indices[i] for i in morton_order(indices)):
             position = np.asanyarray(index, dtype=np.int32) * size
             block = sopt.get_block_at(index, (2, 2, 2), offset=(0, 0, 0))
             pad = sopt.block_to_array(block)
             block_sopt = pad[:size + 1, :size + 1, :size + 1]
+            if np.count_nonzero(block_sopt) < 3:  # Skip chunks without any face, e.g. the padding chunks
+                continue
+
+            # Octaeder segments
+            voxel_segments = extract_voxel_segments(segment_volume, segment_offset, block_sopt, position)
+
+            # Visit only the blocks that can produce a face
+            corner_cuts = _corner_cut_edges(block_sopt, voxel_segments)
+            candidates = _candidate_blocks(corner_cuts)
+            if len(candidates) == 0:
+                continue
 
             # Surface normals
             arr_normals = normals.block_to_array(normals.get_block_at(index, (2, 2, 2), offset=(0, 0, 0)))
             block_normals = arr_normals[:size + 1, :size + 1, :size + 1]
 
-            # Octaeder segments
-            voxel_segments = extract_voxel_segments(nodes_index, segments, block_sopt, position)
-
-            v, f = voxel_render.reduce_mesh(_extract_polygon_edges(block_sopt, voxel_segments, block_normals))
-            # v, f = voxel_render.reduce_mesh(_extract_polygon_edges(block_sopt))
+            v, f = _extract_polygon_edges(block_sopt, corner_cuts, block_normals, candidates)
             v += position
             result.append((v, f))
 
@@ -259,67 +361,63 @@ class MeshExtraction:
 
 class Smoothing:
     def smooth(self, vertices: np.ndarray, faces: np.ndarray, diffusion: ChunkGrid[float], original_mesh: Meshes,
-               max_iteration=50):
+               max_iteration=50, device: Optional[torch.device] = None):
+        """
+        Laplacian smoothing of the mesh, restricted to stay within the diffusion distance of the original surface
+        :param device: device to smooth on, defaults to the device of the original mesh
+        :return: smoothed vertices on the chosen device
+        """
         assert max_iteration > -1
         change = True
         iteration = 0
-        loss_mesh = original_mesh.clone()
-        smooth_verts = loss_mesh.verts_packed().clone()
-        neighbors = self.compute_neighbors(vertices, faces)
-        neighbor_len = torch.IntTensor([len(neighbors[i]) for i in range(len(vertices))])
-        neighbor_valences = torch.FloatTensor(
-            [sum([1 / neighbor_len[n] for n in neighbors[i]]) for i in range(len(vertices))])
+        if device is not None:
+            original_mesh = original_mesh.to(device)
+        device = original_mesh.device
+        smooth_verts = original_mesh.verts_packed().clone()
+        # The uniform Laplacian only depends on the faces, which never change, so it is built once
+        with torch.no_grad():
+            L = original_mesh.laplacian_packed()
+        indptr, indices = self.compute_neighbors(vertices, faces)
+        counts = np.diff(indptr)
+        neighbor_len = torch.from_numpy(counts.astype(np.int32))
+        # Sum of the inverse neighbor counts over the neighbors of each vertex
+        rows = np.repeat(np.arange(len(counts)), counts)
+        neighbor_valences = torch.from_numpy(
+            np.bincount(rows, weights=1 / counts[indices], minlength=len(counts)).astype(np.float32))
         d = 1 + 1 / neighbor_len * neighbor_valences
 
-        difference_max = torch.as_tensor(diffusion.get_values(vertices) + 1)
+        inv_d = (1 / d).unsqueeze(1).to(device)
+
+        original_verts = original_mesh.verts_packed()
+        # Compare squared distances, so no square root is needed per vertex
+        difference_max_sq = (torch.as_tensor(diffusion.get_values(vertices) + 1) ** 2).to(device)
 
         while change and iteration < max_iteration:
             iteration += 1
             change = False
 
-            for i in range(2):
-                with torch.no_grad():
-                    L = loss_mesh.laplacian_packed()
-                loss = L.mm(loss_mesh.verts_packed())
-                if i == 0:
-                    loss_mesh = Meshes([loss], loss_mesh.faces_list())
-
-            # new_vals = smooth_verts - (1/d).unsqueeze(1) * loss
-            # difference = torch.sqrt(torch.sum(torch.pow(original_mesh.verts_packed() - new_vals, 2), dim=1))
+            loss = torch.sparse.mm(L, torch.sparse.mm(L, smooth_verts))
 
-            new_val = smooth_verts - (loss.T * (1 / d)).T
-            differences = torch.linalg.norm(original_mesh.verts_packed() - new_val, dim=1)
-            cond = differences < difference_max
+            # Update all vertices at once, but only those that stay close enough to the original surface
+            new_val = smooth_verts - inv_d * loss
+            differences_sq = torch.sum((original_verts - new_val) ** 2, dim=1)
+            cond = differences_sq < difference_max_sq
             if torch.any(cond):
                 smooth_verts[cond] = new_val[cond]
                 change = True
-
-            # for i, v in enumerate(vertices):
-            #     new_val = smooth_verts[i] - (1 / d[i] * loss[i])
-            #     difference = torch.dist(original_mesh.verts_packed()[i], new_val)
-            #     if difference < difference_max[i]:
-            #         smooth_verts[i] = new_val
-            #         change = True
-
-            loss_mesh = Meshes([smooth_verts], original_mesh.faces_list())
         return smooth_verts
 
-    def compute_neighbors(self, vertices: np.ndarray, faces: np.ndarray) -> List[Set]:
-        neighbors = [set() for i in vertices]
-        for face in faces:
-            for v in face:
-                neighbors[v].update(face)
-        for v, s in enumerate(neighbors):
-            s.remove(v)
-        return neighbors
+    def compute_neighbors(self, vertices: np.ndarray, faces: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the neighbors of each vertex, i.e. the other vertices of the faces it is part of
+        :return: neighbors in CSR form (indptr, indices), the neighbors of vertex i are indices[indptr[i]:indptr[i+1]]
+        """
+        faces = np.asarray(faces, dtype=np.int64)
+        # Directed vertex pairs of all faces, without the self-pairs of degenerate faces
+        pairs = np.concatenate([faces[:, (a, b)] for a, b in itertools.permutations(range(3), 2)])
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        n = len(vertices)
+        keys = np.unique(pairs[:, 0] * n + pairs[:, 1])
+        indptr = np.searchsorted(keys, np.arange(n + 1) * n)
+        return indptr, keys % n
 
-
-@numba.njit(fastmath=True, inline='always')
-def _distance_block(a: Vec3i, b: Vec3i):
-    return abs(b[0] - a[0]) + abs(b[1] - a[1]) + abs(b[2] - a[2])
-
-
-@numba.njit(fastmath=True, inline='always')
-def _is_block_neighbor(a: Vec3i, b: Vec3i):
-    s = _distance_block(a, b)
-    return s == 1 or s == 2  # Direct neighbor or edge neighbor; but not identity and not diagonal!
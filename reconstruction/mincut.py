@@ -2,14 +2,46 @@ from typing import Tuple, Sequence
 
 import maxflow
 import numpy as np
-import tqdm
 
 from reconstruction.data.chunks import ChunkGrid
 from reconstruction.data.faces import ChunkFace
-from reconstruction.mathlib import Vec3i
+from reconstruction.mathlib import Vec3i, morton_order
 
 MinCutNodeIndex = Tuple[Vec3i, ChunkFace]
 
+# Node position offset and face per voxel face (see MinCut.get_node)
+_NODE_OFFSETS = np.array([f.direction() if f % 2 else (0, 0, 0) for f in ChunkFace], dtype=int)
+_NODE_FACES = np.array([f.flip() if f % 2 else f for f in ChunkFace], dtype=int)
+# Same offsets as plain int tuples, for the scalar MinCut.get_node
+_NODE_DIRECTIONS = tuple(tuple(o) for o in _NODE_OFFSETS.tolist())
+# Offset of the second voxel of a node per node face (see MinCut.to_voxel)
+_VOXEL_OFFSETS = np.array([f.direction() * (f.flip() % 2) for f in ChunkFace], dtype=int)
+
+# Face pairs that are linked within a voxel
+_OCTAHEDRON_EDGES = np.array([
+    (ChunkFace.NORTH, ChunkFace.EAST), (ChunkFace.NORTH, ChunkFace.WEST),
+    (ChunkFace.NORTH, ChunkFace.TOP), (ChunkFace.NORTH, ChunkFace.BOTTOM),
+    (ChunkFace.SOUTH, ChunkFace.EAST), (ChunkFace.SOUTH, ChunkFace.WEST),
+    (ChunkFace.SOUTH, ChunkFace.TOP), (ChunkFace.SOUTH, ChunkFace.BOTTOM),
+    (ChunkFace.TOP, ChunkFace.EAST), (ChunkFace.TOP, ChunkFace.WEST),
+    (ChunkFace.BOTTOM, ChunkFace.EAST), (ChunkFace.BOTTOM, ChunkFace.WEST)
+], dtype=int)
+# Grid structure for add_grid_edges on (M, 2) node pairs: links each first to the second node of its row
+_EDGE_STRUCTURE = np.array([[0, 0, 0],
+                            [0, 0, 1],
+                            [0, 0, 0]])
+
+
+# Bits per axis of packed node keys
+_NODE_KEY_BITS = 20
+# Faces by value, cheaper than constructing the enum
+_FACES = tuple(ChunkFace)
+
+
+def _where(grid: ChunkGrid[bool]) -> np.ndarray:
+    """All set positions of a boolean grid as (N, 3) array"""
+    return np.concatenate([c.where() for c in grid.chunks] + [np.empty((0, 3), dtype=int)])
+
 
 # =====================================================================
 # MinCut
@@ -32,60 +64,74 @@ class MinCut:
                  crust_inner: ChunkGrid[bool], s=4, a=1e-20):
         self.crust = crust
 
-        # Method cache
-        get_node = MinCut.get_node
-
         self.weights = (diff ** s) + a
         self.weights[~crust] = -1
         self.weights.cleanup(remove=True)
 
-        self.voxels = {tuple(p): w for p, w in self.weights.items(mask=crust) if w >= 0}
-        self.nodes = list(set(get_node(p, f) for p in self.voxels.keys() for f in ChunkFace))
-        self.nodes_index = {f: n for n, f in enumerate(self.nodes)}
-        nodes_index = self.nodes_index
+        voxels = [(tuple(p), w) for p, w in self.weights.items(mask=crust) if w >= 0]
+        # Visit the voxels along the Z-order curve, so that the edges of neighboring voxels are added close together
+        self.voxels = dict(voxels[i] for i in morton_order([p for p, _ in voxels]))
+
+        # Enumerate all unique nodes at once on packed int64 keys (packing keeps the lexicographic order),
+        # the inverse gives the 6 nodes of each voxel and the sorted keys are used for vectorized lookups
+        voxel_pos = np.array(list(self.voxels.keys()), dtype=int).reshape((-1, 3))
+        self._node_low = voxel_pos.min(axis=0) - 1 if len(voxel_pos) else np.zeros(3, dtype=int)
+        voxel_keys = self._pack_nodes(MinCut.get_nodes(voxel_pos))
+        assert np.all(voxel_keys >= 0), "crust is too large for packed node keys"
+        self._node_keys, inverse = np.unique(voxel_keys, return_inverse=True)
+        self.voxel_nodes = inverse.reshape((-1, 6))
+        self.nodes = [((x, y, z), _FACES[f]) for x, y, z, f in self._unpack_nodes(self._node_keys).tolist()]
 
         nodes_count = len(self.nodes)
 
         self.graph = maxflow.Graph[float](nodes_count, nodes_count)
         self.graph.add_nodes(nodes_count)
 
-        # Method cache
-        grap_add_edge = self.graph.add_edge
-        grap_add_tedge = self.graph.add_tedge
-        nodes_index_get = self.nodes_index.get
-        # Name cache
-        CF = ChunkFace
-
-        # visited: Set[Tuple[Tuple[Vec3i, CF], Tuple[Vec3i, CF]]] = set()
-        for vPos, w in tqdm.tqdm(self.voxels.items(), total=len(self.voxels), desc="Linking Faces"):
-            iN = nodes_index[get_node(vPos, CF.NORTH)]
-            iS = nodes_index[get_node(vPos, CF.SOUTH)]
-            iT = nodes_index[get_node(vPos, CF.TOP)]
-            iB = nodes_index[get_node(vPos, CF.BOTTOM)]
-            iE = nodes_index[get_node(vPos, CF.EAST)]
-            iW = nodes_index[get_node(vPos, CF.WEST)]
-            for f, o in [
-                (iN, iE), (iN, iW), (iN, iT), (iN, iB),
-                (iS, iE), (iS, iW), (iS, iT), (iS, iB),
-                (iT, iE), (iT, iW), (iB, iE), (iB, iW)
-            ]:  # type: ChunkFace
-                grap_add_edge(f, o, w, w)
+        # Link the faces of each voxel (octahedron edges), all edges are passed to the graph in a single call
+        weights = np.fromiter(self.voxels.values(), dtype=float, count=len(self.voxels))
+        edges = self.voxel_nodes[:, _OCTAHEDRON_EDGES].reshape((-1, 2))
+        self.graph.add_grid_edges(edges, weights=np.repeat(weights, len(_OCTAHEDRON_EDGES))[:, None],
+                                  structure=_EDGE_STRUCTURE, symmetric=True)
 
         # Source
-        for vPos in tqdm.tqdm(list(crust_outer.where()), desc="Linking Source"):
-            for f in ChunkFace:  # type: ChunkFace
-                fNode = get_node(tuple(vPos), f)
-                fIndex = nodes_index_get(fNode, None)
-                if fIndex is not None:
-                    grap_add_tedge(fIndex, 10000, 0)
+        source_ids = self.node_ids(MinCut.get_nodes(_where(crust_outer))).ravel()
+        self.graph.add_grid_tedges(source_ids[source_ids >= 0], 10000, 0)
 
         # Sink
-        for vPos in tqdm.tqdm(list(crust_inner.where()), desc="Linking Sink"):
-            for f in ChunkFace:  # type: ChunkFace
-                fNode = get_node(tuple(vPos), f)
-                fIndex = nodes_index_get(fNode, None)
-                if fIndex is not None:
-                    grap_add_tedge(fIndex, 0, 10000)
+        sink_ids = self.node_ids(MinCut.get_nodes(_where(crust_inner))).ravel()
+        self.graph.add_grid_tedges(sink_ids[sink_ids >= 0], 0, 10000)
+
+    def _pack_nodes(self, nodes: np.ndarray) -> np.ndarray:
+        """Pack (..., 4) nodes into int64 keys, -1 for nodes outside of the packable range around the crust"""
+        p = nodes[..., :3] - self._node_low
+        valid = np.all((p >= 0) & (p < (1 << _NODE_KEY_BITS)), axis=-1)
+        keys = (p[..., 0] << (2 * _NODE_KEY_BITS + 3)) | (p[..., 1] << (_NODE_KEY_BITS + 3)) | (p[..., 2] << 3) \
+               | nodes[..., 3]
+        return np.where(valid, keys, -1)
+
+    def _unpack_nodes(self, keys: np.ndarray) -> np.ndarray:
+        """Inverse of _pack_nodes, returns (..., 4) nodes"""
+        mask = (1 << _NODE_KEY_BITS) - 1
+        nodes = np.empty((*keys.shape, 4), dtype=int)
+        nodes[..., 0] = keys >> (2 * _NODE_KEY_BITS + 3)
+        nodes[..., 1] = (keys >> (_NODE_KEY_BITS + 3)) & mask
+        nodes[..., 2] = (keys >> 3) & mask
+        nodes[..., :3] += self._node_low
+        nodes[..., 3] = keys & 7
+        return nodes
+
+    def node_ids(self, nodes: np.ndarray) -> np.ndarray:
+        """
+        Vectorized lookup of node ids
+        :param nodes: (..., 4) array of nodes as (x, y, z, face)
+        :return: node ids with the leading shape of nodes, -1 for nodes that are not part of the graph
+        """
+        nodes = np.asarray(nodes, dtype=int)
+        if len(self._node_keys) == 0:
+            return np.full(nodes.shape[:-1], -1, dtype=int)
+        keys = self._pack_nodes(nodes)
+        idx = np.minimum(np.searchsorted(self._node_keys, keys), len(self._node_keys) - 1)
+        return np.where((keys >= 0) & (self._node_keys[idx] == keys), idx, -1)
 
     def segments(self):
         if self._segments is None:
@@ -94,16 +140,14 @@ class MinCut:
         return self._segments
 
     def grid_segments(self) -> Tuple[ChunkGrid[np.bool8], ChunkGrid[np.bool8]]:
-        to_voxel = MinCut.to_voxel
-        segments = self.segments()
+        segments = self.segments().astype(bool)
+        voxels = MinCut.to_voxels(self._unpack_nodes(self._node_keys))
         if self._grid_segment0 is None:
             self._grid_segment0 = ChunkGrid(self.crust.chunk_size, np.bool8, False)
-            self._grid_segment0[[p for node, s in zip(self.nodes, segments) if s == False
-                                 for p in to_voxel(node)]] = True
+            self._grid_segment0[voxels[~segments].reshape((-1, 3))] = True
         if self._grid_segment1 is None:
             self._grid_segment1 = ChunkGrid(self.crust.chunk_size, np.bool8, False)
-            self._grid_segment1[[p for node, s in zip(self.nodes, segments) if s == True
-                                 for p in to_voxel(node)]] = True
+            self._grid_segment1[voxels[segments].reshape((-1, 3))] = True
         return self._grid_segment0, self._grid_segment1
 
     @staticmethod
@@ -111,13 +155,39 @@ class MinCut:
         """Basically forces to have only positive-direction faces"""
         if face % 2 == 0:
             return pos, face
-        else:
-            return tuple(np.add(pos, face.direction(), dtype=int)), face.flip()
+        dx, dy, dz = _NODE_DIRECTIONS[face]
+        return (pos[0] + dx, pos[1] + dy, pos[2] + dz), face.flip()
+
+    @staticmethod
+    def get_nodes(positions: np.ndarray) -> np.ndarray:
+        """
+        Vectorized get_node for all faces of many voxels
+        :param positions: (N, 3) voxel positions
+        :return: (N, 6, 4) array of nodes as (x, y, z, face), the second axis is indexed by ChunkFace
+        """
+        positions = np.asarray(positions, dtype=int)
+        result = np.empty((len(positions), 6, 4), dtype=int)
+        result[:, :, :3] = positions[:, None, :] + _NODE_OFFSETS
+        result[:, :, 3] = _NODE_FACES
+        return result
 
     @staticmethod
     def to_voxel(nodeIndex: MinCutNodeIndex) -> Sequence[Vec3i]:
         pos, face = nodeIndex
         return [
             pos,
-            np.asarray(face.direction()) * (face.flip() % 2) + pos
+            _VOXEL_OFFSETS[face] + pos
         ]
+
+    @staticmethod
+    def to_voxels(nodes: np.ndarray) -> np.ndarray:
+        """
+        Vectorized to_voxel
+        :param nodes: (N, 4) array of nodes as (x, y, z, face)
+        :return: (N, 2, 3) array with the two voxels of each node
+        """
+        nodes = np.asarray(nodes, dtype=int)
+        result = np.empty((len(nodes), 2, 3), dtype=int)
+        result[:, 0] = nodes[:, :3]
+        result[:, 1] = nodes[:, :3] + _VOXEL_OFFSETS[nodes[:, 3]]
+        return result
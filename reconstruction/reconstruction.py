@@ -1,15 +1,20 @@
 """
 Steps and methods used during model reconstruction
 """
-from typing import Optional, Tuple
+import functools
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
 
 import numba
 import numpy as np
-from scipy import ndimage
 
-from reconstruction.data.chunks import ChunkGrid, Chunk
+from reconstruction.data.chunks import ChunkGrid, Chunk, Index
+from reconstruction.data.faces import ChunkFace
 from reconstruction.filters.dilate import dilate
-from reconstruction.filters.fill import flood_fill_at
+from reconstruction.filters.fill import flood_fill_at, label_components
 from reconstruction.mathlib import Vec3i, Vec3f
 from reconstruction.render.voxel_render import VoxelRender
 
@@ -43,9 +48,11 @@ def find_empty_point_in_chunk(mask: Chunk[np.bool8]) -> Optional[Vec3i]:
         if mask.value:
             return mask.position_low
     else:
-        pt = np.argwhere(mask.to_array())
-        if len(pt) > 0:
-            return pt[0] + mask.position_low
+        arr = mask.to_array()
+        # argmax returns the first True voxel without collecting all of them like argwhere
+        idx = arr.argmax()
+        if arr.flat[idx]:
+            return np.array(np.unravel_index(idx, arr.shape)) + mask.position_low
     return None
 
 
@@ -55,7 +62,7 @@ def find_empty_fill_position(mask: ChunkGrid[np.bool8]) -> Optional[Vec3i]:
     :param mask: voxel grid
     :return: global voxel position or None
     """
-    for i, c in mask.chunks.items():
+    for c in mask.chunks.values():
         if c.any():
             return find_empty_point_in_chunk(c)
     return None
@@ -72,9 +79,7 @@ def points_on_chunk_hull(mask: ChunkGrid[np.bool8], count: int = 1) -> Optional[
         return None
 
     pts_iter = (c.position_low for c in mask.iter_hull() if c.is_filled() and not c.value)
-    pts = []
-    for p, _ in zip(pts_iter, range(count)):
-        pts.append(p)
+    pts = list(itertools.islice(pts_iter, count))
     if pts:
         return np.asarray(pts, dtype=int)
     else:
@@ -97,16 +102,28 @@ def fill_components(crust: ChunkGrid[np.bool8], max_components=4) -> Tuple[Chunk
     components = crust.copy(dtype=np.int8, fill_value=np.int8(0))
     count = 1
     target_fill = points_on_chunk_hull(~crust)
-    while target_fill is not None:
-        count += 1
-        if count > max_components:
-            break
-        fill_mask = flood_fill_at(target_fill, mask=components == 0)
-        assert fill_mask._fill_value == (count == 2)  # Error when the outer fill does not set the _fill_value
-
-        components[fill_mask] = count
-        # Update for next iteration
-        target_fill = find_empty_fill_position(components == 0)
+    if target_fill is None:
+        return components, count
+    count += 1
+    if count > max_components:
+        return components, count
+
+    # The outer component is unbounded, so it is flood filled
+    fill_mask = flood_fill_at(target_fill, mask=components == 0)
+    assert fill_mask._fill_value  # Error when the outer fill does not set the _fill_value
+    components[fill_mask] = count
+
+    # Label all remaining inner components in a single pass
+    labels, label_count = label_components(components == 0)
+    assigned = min(label_count, max_components - count)
+    lut = np.zeros(label_count + 1, dtype=np.int8)
+    lut[1:assigned + 1] = np.arange(count + 1, count + 1 + assigned)
+    for index, lc in labels.chunks.items():
+        values = lut[lc.to_array()]
+        sel = values > 0
+        if sel.any():
+            components.ensure_chunk_at_index(index)[sel] = values[sel]
+    count = min(count + label_count, max_components + 1)
     return components, count
 
 
@@ -176,42 +193,104 @@ def cleanup_components(crust: ChunkGrid[np.bool8], components: ChunkGrid[np.int8
 # Distance Diffusion
 # =====================================================================
 
-def diffuse(model: ChunkGrid[bool], repeat=1):
+@numba.njit(nogil=True, fastmath=True)
+def _diffuse_kernel(src: np.ndarray, out: np.ndarray, mask_zero: np.ndarray):
+    """
+    Average each voxel with its face and edge neighbors (the three axis-aligned 3x3 planes through the voxel).
+    :param src: padded source array, one voxel larger on each side than out
+    :param out: output array
+    :param mask_zero: voxels that are set to zero instead
+    """
+    sx, sy, sz = out.shape
+    for i in range(sx):
+        for j in range(sy):
+            for k in range(sz):
+                if mask_zero[i, j, k]:
+                    out[i, j, k] = 0.0
+                else:
+                    # Plane x=1 (9 taps), rest of plane y=1 (6 taps), rest of plane z=1 (4 taps)
+                    s = (src[i + 1, j, k] + src[i + 1, j, k + 1] + src[i + 1, j, k + 2]
+                         + src[i + 1, j + 1, k] + src[i + 1, j + 1, k + 1] + src[i + 1, j + 1, k + 2]
+                         + src[i + 1, j + 2, k] + src[i + 1, j + 2, k + 1] + src[i + 1, j + 2, k + 2]
+                         + src[i, j + 1, k] + src[i, j + 1, k + 1] + src[i, j + 1, k + 2]
+                         + src[i + 2, j + 1, k] + src[i + 2, j + 1, k + 1] + src[i + 2, j + 1, k + 2]
+                         + src[i, j, k + 1] + src[i, j + 2, k + 1]
+                         + src[i + 2, j, k + 1] + src[i + 2, j + 2, k + 1])
+                    out[i, j, k] = s * (1.0 / 19.0)
+
+
+def diffuse(model: ChunkGrid[bool], repeat=1, workers: Optional[int] = None):
     """
     Diffuse the voxels in model to their neighboring voxels
     :param model: the model to diffuse
     :param repeat: number of diffusion steps
+    :param workers: number of threads diffusing chunks concurrently, defaults to the cpu count
     :return: diffused model
     """
-    kernel = np.zeros((3, 3, 3), dtype=float)
-    kernel[1] = 1
-    kernel[:, 1] = 1
-    kernel[:, :, 1] = 1
-    kernel /= np.sum(kernel)
-
+    workers = workers or os.cpu_count() or 1
     result = ChunkGrid(model.chunk_size, dtype=float, fill_value=1.0)
     result[model] = 0.0
     result.pad_chunks(repeat // result.chunk_size + 1)
 
-    for r in range(repeat):
-        tmp = result.copy(empty=True)
-        for chunk in result.chunks:
-            padded = chunk.padding(result, 1)
-            ndimage.convolve(padded, kernel, output=padded, mode='constant', cval=1.0)
-            conv = padded[1:-1, 1:-1, 1:-1]
-            m = model.ensure_chunk_at_index(chunk.index, insert=False)
-            if m.is_filled():
-                if m.value:
-                    tmp.ensure_chunk_at_index(chunk.index).set_fill(0.0)
+    # Neighbor offsets as plain tuples, so the chunk indices stay tuples of python ints
+    neighbor_offsets = [tuple(f.direction().tolist()) for f in ChunkFace]
+
+    # The model does not change between steps, so its per chunk masks are only built once (None if fully model)
+    zero_masks: Dict[Index, Optional[np.ndarray]] = dict()
+    no_zeros = np.zeros(result.chunk_shape, dtype=np.bool8)
+
+    def zero_mask(index: Index) -> Optional[np.ndarray]:
+        if index in zero_masks:
+            return zero_masks[index]
+        m = model.ensure_chunk_at_index(index, insert=False)
+        if m.is_filled():
+            mask = None if m.value else no_zeros
+        else:
+            mask = m.to_array().astype(np.bool8)
+        zero_masks[index] = mask
+        return mask
+
+    # Each thread reuses one output buffer, set_array() copies it into the chunk
+    buffers = threading.local()
+
+    def diffuse_chunk(src: ChunkGrid[float], dst: Chunk[float], index: Index) -> bool:
+        """Diffuse a single chunk into dst, returns False when the chunk is completely part of the model"""
+        mask = zero_mask(index)
+        if mask is None:
+            dst.set_fill(0.0)
+            return False
+        out = getattr(buffers, "out", None)
+        if out is None:
+            out = buffers.out = np.empty(src.chunk_shape, dtype=float)
+        padded = src.padding_at(index, 1, corners=False, edges=False)
+        _diffuse_kernel(padded, out, mask)
+        dst.set_array(out)
+        return True
+
+    # The chunks only read the previous step, so they are diffused concurrently (the kernel releases the GIL)
+    pool = ThreadPoolExecutor(workers) if workers > 1 else None
+    __map = pool.map if pool is not None else map
+    try:
+        for r in range(repeat):
+            tmp = result.copy(empty=True)
+            # Method cache (prevent lookup in loop)
+            __tmp_ensure_chunk_at_index = tmp.ensure_chunk_at_index
+
+            # Target chunks are created up front, so the workers never modify the grid itself
+            indices = list(result.chunks.keys())
+            targets = [__tmp_ensure_chunk_at_index(index) for index in indices]
+            for index, expand in zip(indices, __map(functools.partial(diffuse_chunk, result), targets, indices)):
+                if not expand:
                     continue
-            else:
-                conv[m.to_array()] = 0.0
-            tmp.ensure_chunk_at_index(chunk.index).set_array(conv)
-            # Expand chunks
-            for f, i in ChunkGrid.iter_neighbors_indices(chunk.index):
-                tmp.ensure_chunk_at_index(i)
-
-        result = tmp
+                # Expand chunks
+                x, y, z = index
+                for u, v, w in neighbor_offsets:
+                    __tmp_ensure_chunk_at_index((x + u, y + v, z + w))
+
+            result = tmp
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
     result.cleanup(remove=True)
     return result
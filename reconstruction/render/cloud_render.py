@@ -1,61 +1,122 @@
-from typing import Sequence, Tuple
+from typing import Tuple, Optional, Dict
 
 import numpy as np
 import plotly.graph_objects as go
 
 from reconstruction.data.chunks import ChunkGrid
-from reconstruction.mathlib import Vec3i
 from reconstruction.model.model_mesh import MeshModelLoader
 from reconstruction.utils import merge_default
 
 
+# Static figure layout, plotly copies it into each figure
+_CAMERA = dict(
+    up=dict(x=0, y=1, z=0),
+    eye=dict(x=-1.5, y=0.7, z=1.4)
+)
+_FIGURE_LAYOUT = dict(
+    yaxis=dict(scaleanchor="x", scaleratio=1),
+    scene=dict(
+        aspectmode='data',
+        camera=_CAMERA,
+        dragmode='orbit'
+    ),
+    scene_camera=_CAMERA
+)
+
+
 class CloudRender:
 
     @classmethod
     def _unwrap(cls, data: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         if len(data) == 0:
-            return np.empty(0), np.empty(0), np.empty(0)
-        x, y, z = np.transpose(data)
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+        # Copy each axis into its own contiguous float32 array, the conversion is done by the same copy.
+        # Plotly would copy the strided views anyway, and float32 is precise enough for display.
+        # The axes of a transposed (3, N) float32 array are already contiguous and not copied.
+        data = np.asarray(data)
+        x = np.ascontiguousarray(data[:, 0], dtype=np.float32)
+        y = np.ascontiguousarray(data[:, 1], dtype=np.float32)
+        z = np.ascontiguousarray(data[:, 2], dtype=np.float32)
         return x, y, z
 
-    def make_scatter(self, pts: np.ndarray, size=0.5, **kwargs):
+    @classmethod
+    def _compact_values(cls, values: np.ndarray) -> np.ndarray:
+        """Downcast 64 bit values for plotting, their serialized representation is about half as long"""
+        if values.dtype == np.float64:
+            return values.astype(np.float32)
+        if values.dtype == np.int64 and len(values):
+            info = np.iinfo(np.int32)
+            if info.min <= values.min() and values.max() <= info.max:
+                return values.astype(np.int32)
+        return values
+
+    @classmethod
+    def _subsample(cls, pts: np.ndarray, max_points: Optional[int], marker: Dict) -> Tuple[np.ndarray, Dict]:
+        """Deterministically select at most max_points points, a per point marker color is selected alike"""
+        if max_points is None or len(pts) <= max_points:
+            return pts, marker
+        idx = np.random.default_rng(0).choice(len(pts), max_points, replace=False)
+        idx.sort()
+        color = marker.get('color', None)
+        if isinstance(color, np.ndarray) and len(color) == len(pts):
+            marker = dict(marker, color=color[idx])
+        return np.asarray(pts)[idx], marker
+
+    def make_scatter(self, pts: np.ndarray, size=0.5, max_points: Optional[int] = 200_000, **kwargs):
+        """
+        Make a scatter plot of points
+        :param pts: (N, 3) array of points
+        :param size: marker size
+        :param max_points: larger clouds are randomly subsampled to keep the browser responsive, None disables it
+        """
         merge_default(kwargs, mode='markers', marker=dict(size=size))
+        pts, kwargs['marker'] = self._subsample(pts, max_points, kwargs['marker'])
         x, y, z = self._unwrap(pts)
         return go.Scatter3d(x=x, y=y, z=z, **kwargs)
 
     def make_figure(self, title=None, **kwargs) -> go.Figure:
         fig = go.Figure(**kwargs)
-        camera = dict(
-            up=dict(x=0, y=1, z=0),
-            eye=dict(x=-1.5, y=0.7, z=1.4)
-        )
-        fig.update_layout(
-            yaxis=dict(scaleanchor="x", scaleratio=1),
-            scene=dict(
-                aspectmode='data',
-                camera=camera,
-                dragmode='orbit'
-            ),
-            scene_camera=camera,
-            title=title
-        )
+        fig.update_layout(_FIGURE_LAYOUT, title=title)
         return fig
 
     def make_value_scatter(self, grid: ChunkGrid, mask: ChunkGrid[bool], **kwargs):
+        # Method cache (prevent lookup in loop)
+        __mask_ensure_chunk_at_index = mask.ensure_chunk_at_index
+
+        # Count the masked voxels first, so that points and values are written once into preallocated arrays
+        masked = []
+        total = 0
+        for index, c in grid.chunks.items():
+            m = __mask_ensure_chunk_at_index(index, insert=False)
+            if m.any_fast():
+                marr = m.to_array().astype(bool)
+                count = int(np.count_nonzero(marr))
+                if count:
+                    masked.append((c, marr, count))
+                    total += count
 
-        items = list(grid.items(mask=mask))
-        points, values = zip(*items)  # type: Sequence[Vec3i], Sequence
-        pts = np.array(points, dtype=np.float32) + 0.5
-        values = np.array(values)
+        # The points are stored per axis (3, N), so each axis is already contiguous for plotting
+        dtype = grid.dtype
+        axes = np.empty((3, total), dtype=np.float32)
+        values = np.empty((total, *dtype.shape), dtype=dtype.base)
+        offset = 0
+        for c, marr, count in masked:
+            end = offset + count
+            idx = np.nonzero(marr)
+            # Add the voxel center of the chunk while writing each axis, without temporary arrays
+            low = c.position_low + 0.5
+            for axis in range(3):
+                np.add(idx[axis], low[axis], out=axes[axis, offset:end], casting='unsafe')
+            values[offset:end] = c.value if c.is_filled() else c.to_array()[idx]
+            offset = end
 
-        merge_default(kwargs, marker=dict(color=values))
-        return self.make_scatter(pts, **kwargs)
+        merge_default(kwargs, marker=dict(color=self._compact_values(values)))
+        return self.make_scatter(axes.T, **kwargs)
 
     def plot(self, *args: np.ndarray, size=0.5, **kwargs):
         fig = self.make_figure()
         merge_default(kwargs, mode='markers', marker=dict(size=size))
-        for d in args:
-            fig.add_trace(self.make_scatter(d, **kwargs))
+        fig.add_traces([self.make_scatter(d, **kwargs) for d in args])
         return fig
 
 
@@ -29,6 +29,7 @@ THE SOFTWARE.
 
 """
 
+import functools
 import uuid
 import json
 import os
@@ -37,12 +38,70 @@ import webbrowser
 import base64
 import gzip
 
+import numpy as np
 import six
 
 from plotly.io._utils import validate_coerce_fig_to_dict
 from plotly.offline.offline import _get_jconfig, get_plotlyjs
 from plotly import utils
 
+try:
+    import orjson
+except ImportError:  # Optional, the json module is used instead
+    orjson = None
+
+# Array types that orjson encodes natively, if the array is C-contiguous
+_ORJSON_DTYPES = frozenset(
+    np.dtype(t)
+    for t in (
+        np.float64, np.float32,
+        np.int64, np.int32, np.int16, np.int8,
+        np.uint64, np.uint32, np.uint16, np.uint8,
+        np.bool_,
+    )
+)
+_plotly_default = utils.PlotlyJSONEncoder().default
+
+# Minimum size of the serialized data in bytes to be compressed
+_COMPRESS_MIN_SIZE = 4096
+
+
+def _default(obj):
+    """
+    Fallback for types orjson does not encode. Strided numeric arrays (e.g. the
+    columns of a point array) are made contiguous, so they are still encoded
+    natively instead of via a Python list.
+    """
+    if (
+        isinstance(obj, np.ndarray)
+        and not obj.flags.c_contiguous
+        and obj.dtype in _ORJSON_DTYPES
+    ):
+        return np.ascontiguousarray(obj)
+    return _plotly_default(obj)
+
+
+def _dumps_bytes(obj, sort_keys=False):
+    """
+    Serialize a figure part to UTF-8 encoded JSON. orjson encodes numpy arrays
+    natively, other types are passed to the plotly encoder.
+    """
+    if orjson is None:
+        return json.dumps(
+            obj, cls=utils.PlotlyJSONEncoder, sort_keys=sort_keys
+        ).encode("utf-8")
+    option = orjson.OPT_SERIALIZE_NUMPY
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, default=_default, option=option)
+
+
+def _dumps(obj, sort_keys=False):
+    """Serialize a figure part to a JSON string, see _dumps_bytes"""
+    if orjson is None:
+        return json.dumps(obj, cls=utils.PlotlyJSONEncoder, sort_keys=sort_keys)
+    return _dumps_bytes(obj, sort_keys=sort_keys).decode("utf-8")
+
 
 # Build script to set global PlotlyConfig object. This must execute before
 # plotly.js is loaded.
@@ -57,7 +116,21 @@ if (window.MathJax) {MathJax.Hub.Config({SVG: {font: "STIX-Web"}});}\
 </script>"""
 
 
-def to_html(
+@functools.lru_cache(maxsize=None)
+def _load_plotlyjs_inline():
+    """
+    Script tags with the inlined plotly.js bundle (~3MB). It is read and built
+    only once per process, as it is the same for every figure.
+    """
+    return """\
+        {win_config}
+        <script type="text/javascript">{plotlyjs}</script>\
+    """.format(
+        win_config=_window_plotly_config, plotlyjs=get_plotlyjs()
+    )
+
+
+def _to_html_parts(
     fig,
     config=None,
     auto_play=True,
@@ -72,88 +145,8 @@ def to_html(
     compress=True,
 ):
     """
-    Convert a figure to an HTML string representation.
-    Parameters
-    ----------
-    fig:
-        Figure object or dict representing a figure
-    config: dict or None (default None)
-        Plotly.js figure config options
-    auto_play: bool (default=True)
-        Whether to automatically start the animation sequence on page load
-        if the figure contains frames. Has no effect if the figure does not
-        contain frames.
-    include_plotlyjs: bool or string (default True)
-        Specifies how the plotly.js library is included/loaded in the output
-        div string.
-        If True, a script tag containing the plotly.js source code (~3MB)
-        is included in the output.  HTML files generated with this option are
-        fully self-contained and can be used offline.
-        If 'cdn', a script tag that references the plotly.js CDN is included
-        in the output. HTML files generated with this option are about 3MB
-        smaller than those generated with include_plotlyjs=True, but they
-        require an active internet connection in order to load the plotly.js
-        library.
-        If 'directory', a script tag is included that references an external
-        plotly.min.js bundle that is assumed to reside in the same
-        directory as the HTML file.
-        If 'require', Plotly.js is loaded using require.js.  This option
-        assumes that require.js is globally available and that it has been
-        globally configured to know how to find Plotly.js as 'plotly'.
-        This option is not advised when full_html=True as it will result
-        in a non-functional html file.
-        If a string that ends in '.js', a script tag is included that
-        references the specified path. This approach can be used to point
-        the resulting HTML file to an alternative CDN or local bundle.
-        If False, no script tag referencing plotly.js is included. This is
-        useful when the resulting div string will be placed inside an HTML
-        document that already loads plotly.js. This option is not advised
-        when full_html=True as it will result in a non-functional html file.
-    include_mathjax: bool or string (default False)
-        Specifies how the MathJax.js library is included in the output html
-        div string.  MathJax is required in order to display labels
-        with LaTeX typesetting.
-        If False, no script tag referencing MathJax.js will be included in the
-        output.
-        If 'cdn', a script tag that references a MathJax CDN location will be
-        included in the output.  HTML div strings generated with this option
-        will be able to display LaTeX typesetting as long as internet access
-        is available.
-        If a string that ends in '.js', a script tag is included that
-        references the specified path. This approach can be used to point the
-        resulting HTML div string to an alternative CDN.
-    post_script: str or list or None (default None)
-        JavaScript snippet(s) to be included in the resulting div just after
-        plot creation.  The string(s) may include '{plot_id}' placeholders
-        that will then be replaced by the `id` of the div element that the
-        plotly.js figure is associated with.  One application for this script
-        is to install custom plotly.js event handlers.
-    full_html: bool (default True)
-        If True, produce a string containing a complete HTML document
-        starting with an <html> tag.  If False, produce a string containing
-        a single <div> element.
-    animation_opts: dict or None (default None)
-        dict of custom animation parameters to be passed to the function
-        Plotly.animate in Plotly.js. See
-        https://github.com/plotly/plotly.js/blob/master/src/plots/animation_attributes.js
-        for available options. Has no effect if the figure does not contain
-        frames, or auto_play is False.
-    default_width, default_height: number or str (default '100%')
-        The default figure width/height to use if the provided figure does not
-        specify its own layout.width/layout.height property.  May be
-        specified in pixels as an integer (e.g. 500), or as a css width style
-        string (e.g. '500px', '100%').
-    validate: bool (default True)
-        True if the figure should be validated before being converted to
-        JSON, False otherwise.
-    compress: bool (default False)
-        If True, the figure data is compressed reducing the total file size.
-        It adds an external compression library which requires an active 
-        internet connection.
-    Returns
-    -------
-    str
-        Representation of figure as an HTML div string
+    Build the HTML representation of a figure as a list of string parts, see to_html.
+    Joining the parts gives the HTML, the large parts (data, plotly.js) are not copied.
     """
 
     # ## Validate figure ##
@@ -163,16 +156,21 @@ def to_html(
     plotdivid = str(uuid.uuid4())
 
     # ## Serialize figure ##
-    jdata = json.dumps(
-        fig_dict.get("data", []), cls=utils.PlotlyJSONEncoder, sort_keys=True
-    )
+    # The data is kept as bytes when it is compressed, saving a copy of the largest part.
+    # Its keys are not sorted, plotly.js does not depend on the order.
+    if compress:
+        jdata_bytes = _dumps_bytes(fig_dict.get("data", []))
+        if len(jdata_bytes) < _COMPRESS_MIN_SIZE:
+            # Inline small data, the compression overhead would outweigh the savings
+            compress = False
+            jdata = jdata_bytes.decode("utf-8")
+    else:
+        jdata = _dumps(fig_dict.get("data", []))
 
-    jlayout = json.dumps(
-        fig_dict.get("layout", {}), cls=utils.PlotlyJSONEncoder, sort_keys=True
-    )
+    jlayout = _dumps(fig_dict.get("layout", {}), sort_keys=True)
 
     if fig_dict.get("frames", None):
-        jframes = json.dumps(fig_dict.get("frames", []), cls=utils.PlotlyJSONEncoder)
+        jframes = _dumps(fig_dict.get("frames", []))
     else:
         jframes = None
 
@@ -240,11 +238,12 @@ def to_html(
     then_addframes = ""
     then_animate = ""
     if jframes:
+        # The frames are concatenated, only the small template is formatted
         then_addframes = """.then(function(){{
-                            Plotly.addFrames('{id}', {frames});
-                        }})""".format(
-            id=plotdivid, frames=jframes
-        )
+                            Plotly.addFrames('{id}', """.format(
+            id=plotdivid
+        ) + jframes + """);
+                        })"""
 
         if auto_play:
             if animation_opts:
@@ -260,41 +259,69 @@ def to_html(
     # Serialize config dict to JSON
     jconfig = json.dumps(config)
 
-    # Compress data via fflate and use a variable "data" to store the unpacked.
+    # Compress data via gzip and use a variable "data" to store the unpacked.
+    # The compressed data is stored in a separate non-executed block, so that the
+    # JavaScript parser does not have to scan it as a string literal.
+    # It is decompressed by the native DecompressionStream of the browser, which
+    # is asynchronous, so the plot is created once the data is available.
     script_compress = ""
+    script_compress_end = ""
+    data_block = ""
     if compress:
-        compressed_data = base64.b64encode(gzip.compress(jdata.encode('utf-8'))).decode('ascii');
+        compressed_data = base64.b64encode(
+            gzip.compress(jdata_bytes, compresslevel=6, mtime=0)
+        ).decode("ascii")
+        del jdata_bytes
+        data_block = '<script type="text/plain" id="{id}-data">{compressed_data}</script>'.format(
+            id=plotdivid, compressed_data=compressed_data
+        )
         script_compress = """\
-                const data_compr_b64 = "{compressed_data}";
-                const data_raw = fflate.decompressSync(
-                    fflate.strToU8(atob(data_compr_b64), true)
-                );
-                const data = JSON.parse(fflate.strFromU8(data_raw));     
+                (async function() {{
+                const data_b64 = atob(document.getElementById("{id}-data").textContent);
+                const data_compr = new Uint8Array(data_b64.length);
+                for (let i = 0; i < data_b64.length; i++) {{
+                    data_compr[i] = data_b64.charCodeAt(i);
+                }}
+                const stream = new Blob([data_compr]).stream()
+                    .pipeThrough(new DecompressionStream("gzip"));
+                const data = JSON.parse(await new Response(stream).text());
             """.format(
-                compressed_data=compressed_data
+                id=plotdivid
             )
+        script_compress_end = "})();"
         # Replace the plotly data with the variable "data".
         jdata = "data"
 
-    script = """\
+    # The script is kept as parts around the (large) data, layout and config,
+    # only the small templates between them are formatted
+    script = [
+        """\
                 if (document.getElementById("{id}")) {{\
                     {script_compress}\
                     Plotly.newPlot(\
                         "{id}",\
-                        {data},\
-                        {layout},\
-                        {config}\
-                    ){then_addframes}{then_animate}{then_post_script}\
+                        """.format(
+            id=plotdivid,
+            script_compress=script_compress,
+        ),
+        jdata,
+        """,\
+                        """,
+        jlayout,
+        """,\
+                        """,
+        jconfig,
+        """\
+                    )""",
+        then_addframes,
+        then_animate,
+        then_post_script,
+        """;\
+                    {script_compress_end}\
                 }}""".format(
-        id=plotdivid,
-        data=jdata,
-        script_compress=script_compress,
-        layout=jlayout,
-        config=jconfig,
-        then_addframes=then_addframes,
-        then_animate=then_animate,
-        then_post_script=then_post_script,
-    )
+            script_compress_end=script_compress_end,
+        ),
+    ]
 
     # ## Handle loading/initializing plotly.js ##
     include_plotlyjs_orig = include_plotlyjs
@@ -341,18 +368,7 @@ def to_html(
         )
 
     elif include_plotlyjs:
-        load_plotlyjs = """\
-        {win_config}
-        <script type="text/javascript">{plotlyjs}</script>\
-    """.format(
-            win_config=_window_plotly_config, plotlyjs=get_plotlyjs()
-        )
-
-
-    load_fflatejs = ""
-    if compress:
-        load_fflatejs = "<script src=\"https://cdn.jsdelivr.net/npm/fflate@0.6.7/umd/index.min.js\"></script>"
-
+        load_plotlyjs = _load_plotlyjs_inline()
 
     # ## Handle loading/initializing MathJax ##
     include_mathjax_orig = include_mathjax
@@ -392,44 +408,190 @@ include_mathjax may be specified as False, 'cdn', or a string ending with '.js'
             )
         )
 
-    plotly_html_div = """\
+    # The html is joined from its parts only once, so that the large parts
+    # (plotly.js, data block and script) are not copied by each enclosing template.
+    div_head = """\
 <div>\
         {mathjax_script}\
-        {load_plotlyjs}\
-        {load_fflatejs}\
+        """.format(
+        mathjax_script=mathjax_script,
+    )
+    div_plot = """\
             <div id="{id}" class="plotly-graph-div" \
 style="height:{height}; width:{width};"></div>\
+            """.format(
+        id=plotdivid,
+        width=div_width,
+        height=div_height,
+    )
+    script_head = """\
             <script type="text/javascript">\
                 {require_start}\
                     window.PLOTLYENV=window.PLOTLYENV || {{}};{base_url_line}\
-                    {script};\
+                    """.format(
+        base_url_line=base_url_line,
+        require_start=require_start,
+    )
+    script_tail = """;\
                 {require_end}\
             </script>\
         </div>""".format(
-        mathjax_script=mathjax_script,
-        load_plotlyjs=load_plotlyjs,
-        load_fflatejs=load_fflatejs,
-        id=plotdivid,
-        width=div_width,
-        height=div_height,
-        base_url_line=base_url_line,
-        require_start=require_start,
-        script=script,
         require_end=require_end,
-    ).strip()
+    )
+    parts = [div_head, load_plotlyjs, div_plot, data_block, script_head, *script, script_tail]
 
     if full_html:
-        return """\
+        parts.insert(0, """\
 <html>
 <head><meta charset="utf-8" /></head>
 <body>
-    {div}
+    """)
+        parts.append("""
 </body>
-</html>""".format(
-            div=plotly_html_div
+</html>""")
+    return parts
+
+
+def to_html(
+    fig,
+    config=None,
+    auto_play=True,
+    include_plotlyjs=True,
+    include_mathjax=False,
+    post_script=None,
+    full_html=True,
+    animation_opts=None,
+    default_width="100%",
+    default_height="100%",
+    validate=True,
+    compress=True,
+):
+    """
+    Convert a figure to an HTML string representation.
+    Parameters
+    ----------
+    fig:
+        Figure object or dict representing a figure
+    config: dict or None (default None)
+        Plotly.js figure config options
+    auto_play: bool (default=True)
+        Whether to automatically start the animation sequence on page load
+        if the figure contains frames. Has no effect if the figure does not
+        contain frames.
+    include_plotlyjs: bool or string (default True)
+        Specifies how the plotly.js library is included/loaded in the output
+        div string.
+        If True, a script tag containing the plotly.js source code (~3MB)
+        is included in the output.  HTML files generated with this option are
+        fully self-contained and can be used offline.
+        If 'cdn', a script tag that references the plotly.js CDN is included
+        in the output. HTML files generated with this option are about 3MB
+        smaller than those generated with include_plotlyjs=True, but they
+        require an active internet connection in order to load the plotly.js
+        library.
+        If 'directory', a script tag is included that references an external
+        plotly.min.js bundle that is assumed to reside in the same
+        directory as the HTML file.
+        If 'require', Plotly.js is loaded using require.js.  This option
+        assumes that require.js is globally available and that it has been
+        globally configured to know how to find Plotly.js as 'plotly'.
+        This option is not advised when full_html=True as it will result
+        in a non-functional html file.
+        If a string that ends in '.js', a script tag is included that
+        references the specified path. This approach can be used to point
+        the resulting HTML file to an alternative CDN or local bundle.
+        If False, no script tag referencing plotly.js is included. This is
+        useful when the resulting div string will be placed inside an HTML
+        document that already loads plotly.js. This option is not advised
+        when full_html=True as it will result in a non-functional html file.
+    include_mathjax: bool or string (default False)
+        Specifies how the MathJax.js library is included in the output html
+        div string.  MathJax is required in order to display labels
+        with LaTeX typesetting.
+        If False, no script tag referencing MathJax.js will be included in the
+        output.
+        If 'cdn', a script tag that references a MathJax CDN location will be
+        included in the output.  HTML div strings generated with this option
+        will be able to display LaTeX typesetting as long as internet access
+        is available.
+        If a string that ends in '.js', a script tag is included that
+        references the specified path. This approach can be used to point the
+        resulting HTML div string to an alternative CDN.
+    post_script: str or list or None (default None)
+        JavaScript snippet(s) to be included in the resulting div just after
+        plot creation.  The string(s) may include '{plot_id}' placeholders
+        that will then be replaced by the `id` of the div element that the
+        plotly.js figure is associated with.  One application for this script
+        is to install custom plotly.js event handlers.
+    full_html: bool (default True)
+        If True, produce a string containing a complete HTML document
+        starting with an <html> tag.  If False, produce a string containing
+        a single <div> element.
+    animation_opts: dict or None (default None)
+        dict of custom animation parameters to be passed to the function
+        Plotly.animate in Plotly.js. See
+        https://github.com/plotly/plotly.js/blob/master/src/plots/animation_attributes.js
+        for available options. Has no effect if the figure does not contain
+        frames, or auto_play is False.
+    default_width, default_height: number or str (default '100%')
+        The default figure width/height to use if the provided figure does not
+        specify its own layout.width/layout.height property.  May be
+        specified in pixels as an integer (e.g. 500), or as a css width style
+        string (e.g. '500px', '100%').
+    validate: bool (default True)
+        True if the figure should be validated before being converted to
+        JSON, False otherwise.
+    compress: bool (default False)
+        If True, the figure data is compressed reducing the total file size.
+        It is decompressed by the DecompressionStream API of the browser.
+        Data smaller than 4 KB is never compressed.
+    Returns
+    -------
+    str
+        Representation of figure as an HTML div string
+    """
+    return "".join(
+        _to_html_parts(
+            fig,
+            config=config,
+            auto_play=auto_play,
+            include_plotlyjs=include_plotlyjs,
+            include_mathjax=include_mathjax,
+            post_script=post_script,
+            full_html=full_html,
+            animation_opts=animation_opts,
+            default_width=default_width,
+            default_height=default_height,
+            validate=validate,
+            compress=compress,
         )
+    )
+
+
+def to_html_file(fig, path, compress_file=False, **kwargs):
+    """
+    Write a figure to an HTML file. The parts of the HTML are streamed to the
+    file, so the whole document is never held in memory as one string.
+    Parameters
+    ----------
+    fig:
+        Figure object or dict representing a figure
+    path: str
+        Path of the written file
+    compress_file: bool (default False)
+        If True, the file is written gzip compressed (fast level 1), e.g. for
+        a path ending with '.html.gz'.
+    kwargs:
+        Options of to_html
+    """
+    if compress_file:
+        file = gzip.open(path, "wb", compresslevel=1)
     else:
-        return plotly_html_div
+        file = open(path, "wb", buffering=1 << 20)
+    with file:
+        for part in _to_html_parts(fig, **kwargs):
+            file.write(part.encode("utf-8"))
+
 
 
 # Replace original method
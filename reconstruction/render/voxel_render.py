@@ -1,4 +1,4 @@
-from typing import Tuple, Sequence, Iterable, Optional, List
+from typing import Tuple, Sequence, Optional, List
 
 import numba
 import numpy as np
@@ -28,29 +28,65 @@ def _empty_faces(vtype=np.int32) -> Tuple[np.ndarray, np.ndarray]:
     return np.empty((0, 3), dtype=vtype), np.empty((0, 3), dtype=np.uint32)
 
 
+def _unique_vertices(vertices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Same as np.unique(vertices, return_inverse=True, axis=0), but vertices on the integer grid are packed into a
+    single int64 key per vertex first, which avoids the much slower row-wise unique.
+    :param vertices: (N, 3) vertex array
+    :return: unique vertices and the inverse index of each input vertex
+    """
+    if len(vertices) > 0:
+        packed = vertices if np.issubdtype(vertices.dtype, np.integer) else vertices.astype(np.int64)
+        if packed is vertices or np.array_equal(packed, vertices):
+            low = packed.min(axis=0)
+            span = packed.max(axis=0) - low
+            if span.max() < (1 << 21):
+                k = (packed - low).astype(np.int64)
+                key = (k[:, 0] << 42) | (k[:, 1] << 21) | k[:, 2]
+                _, first, inv = np.unique(key, return_index=True, return_inverse=True)
+                return vertices[first], inv
+    return np.unique(vertices, return_inverse=True, axis=0)
+
+
+def _stack_faces(faces: Sequence[np.ndarray], vertices: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    Stack the faces of several meshes into one preallocated array, offsetting their vertex indices in place.
+    This moves the faces once, instead of offsetting a copy per mesh and stacking the copies.
+    """
+    result = np.empty((sum(len(f) for f in faces), 3), dtype=np.result_type(*faces))
+    index = 0
+    start = 0
+    for f, v in zip(faces, vertices):
+        end = start + len(f)
+        out = result[start:end]
+        out[:] = f
+        out += index
+        index += len(v)
+        start = end
+    return result
+
+
 def reduce_mesh(vertices_faces: Sequence[Tuple[np.ndarray, np.ndarray]], vtype=np.int32) \
         -> Tuple[np.ndarray, np.ndarray]:
     # Check if empty
     if len(vertices_faces) == 0:
         return _empty_faces(vtype=vtype)
-    # Increment face indices and filter empty
+    # Filter empty
     vs = []
     fs = []
-    face_index = 0
     for v, f in vertices_faces:
         if len(v) == 0 or len(f) == 0:
             continue
         vs.append(v)
-        fs.append(f + face_index)
-        face_index += len(v)
+        fs.append(f)
     # Re-check if empty
     if len(vs) == 0 or len(fs) == 0:
         return _empty_faces(vtype=vtype)
-    # Stack vertices and faces
+    # Stack vertices and faces, incrementing the face indices
     vs2 = np.vstack(vs)
-    fs2 = np.vstack(fs)
+    fs2 = _stack_faces(fs, vs)
     # Remove duplicates
-    vs3, inv = np.unique(vs2, return_inverse=True, axis=0)
+    vs3, inv = _unique_vertices(vs2)
     fs3 = inv[fs2]
     return vs3, fs3
 
@@ -239,18 +275,11 @@ class MeshHelper:
         if not vertices or not faces:
             return cls._empty()
         vs = np.vstack(vertices)
-        fs = np.vstack(list(cls._join_faces(faces, vertices)))
-        vs2, inv = np.unique(vs, return_inverse=True, axis=0)
+        fs = _stack_faces(faces, vertices)
+        vs2, inv = _unique_vertices(vs)
         fs2 = inv[fs]
         return vs2, fs2
 
-    @classmethod
-    def _join_faces(cls, faces: Sequence[np.ndarray], vertices: Sequence[np.ndarray]) -> Iterable[np.ndarray]:
-        index = 0
-        for f, v in zip(faces, vertices):
-            yield f + index
-            index += len(v)
-
     @classmethod
     def extract_voxel_mesh(cls, mask: np.ndarray, neighbors: Sequence[Optional[Chunk]] = None):
         if neighbors is None:
@@ -25,6 +25,19 @@ class TestChunkGridSetter(unittest.TestCase):
         assert result.shape == expected.shape
         self.assertEqual(str(expected), str(result))
 
+    def test_set_positions(self):
+        a = ChunkGrid(2, int, 0)
+        a[np.array([(0, 0, 0), (3, 1, 2), (-1, 0, 1), (0, 0, 0)])] = [1, 2, 3, 4]
+
+        self.assertEqual(4, a.get_value((0, 0, 0)))  # Last value wins on duplicates
+        self.assertEqual(2, a.get_value((3, 1, 2)))
+        self.assertEqual(3, a.get_value((-1, 0, 1)))
+        self.assertEqual(9, int(a.to_dense().sum()))
+
+        a[np.array([(3, 1, 2), (1, 1, 1)])] = 5
+        self.assertEqual(5, a.get_value((3, 1, 2)))
+        self.assertEqual(5, a.get_value((1, 1, 1)))
+
     def test_mask_1(self):
         a = ChunkGrid(2, int, 0)
 
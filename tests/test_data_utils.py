@@ -1,6 +1,8 @@
 import unittest
 
-from reconstruction.data.data_utils import ValueIter, PositionIter
+import numpy as np
+
+from reconstruction.data.data_utils import ValueIter, PositionIter, MinMaxCheck
 
 
 class TestValueIter(unittest.TestCase):
@@ -55,6 +57,13 @@ class TestValueIter(unittest.TestCase):
         self.assertEqual(3, b.stop)
         self.assertEqual(1, b.step)
 
+    def test_contains(self):
+        a = ValueIter(slice(-3, 5, 2), -3, 5)
+        values = list(range(-6, 8))
+        expected = [v in list(a) for v in values]
+        self.assertListEqual(expected, [v in a for v in values])
+        self.assertListEqual(expected, a.contains_array(np.array(values)).tolist())
+
     def test_iter(self):
         a = ValueIter(slice(1, 5, 1), -3, 5)
         self.assertListEqual(list(range(1, 5)), list(a))
@@ -71,3 +80,40 @@ class TestPositionIter(unittest.TestCase):
             (1, 0, 1),
             (2, 0, 1)
         ], list(a))
+
+    def test_as_array(self):
+        a = PositionIter(slice(None, None, 2), slice(0, 2), slice(1, 2), (-2, -2, -2), (3, 3, 3))
+        arr = a.as_array()
+        self.assertEqual((6, 3), arr.shape)
+        self.assertListEqual(list(a), [tuple(p) for p in arr.tolist()])
+
+    def test_arrays(self):
+        a = PositionIter(slice(None, None, 2), slice(0, 2), slice(1, 2), (-2, -2, -2), (3, 3, 3))
+        i, j, k, u, v, w = a.arrays()
+        self.assertListEqual(list(a.iter_with_indices()),
+                             [((a, b, c), (d, e, f)) for a, b, c, d, e, f in zip(i, j, k, u, v, w)])
+
+
+class TestMinMaxCheck(unittest.TestCase):
+    def test_add(self):
+        a = MinMaxCheck()
+        self.assertEqual((None, None), a.get())
+        a.add((1, -2, 3))
+        a.add((-1, 4, 3))
+        a.add((0, 0, 5))
+        self.assertEqual(((-1, -2, 3), (1, 4, 5)), a.get())
+
+    def test_update(self):
+        a = MinMaxCheck()
+        a.add((9, 9, 9))
+        a.set_dirty()
+        self.assertEqual(((-1, -2, 3), (1, 4, 5)), a.safe(lambda: [(1, -2, 3), (-1, 4, 5)]))
+
+    def test_remove(self):
+        a = MinMaxCheck()
+        a.add((0, 0, 0))
+        a.add((2, 2, 2))
+        a.remove((1, 1, 1))
+        self.assertFalse(a.dirty)
+        a.remove((2, 1, 1))
+        self.assertTrue(a.dirty)
@@ -0,0 +1,38 @@
+import unittest
+
+import numpy as np
+from scipy import ndimage
+
+from reconstruction.data.chunks import ChunkGrid
+from reconstruction.filters.fill import label_components
+
+
+class TestLabelComponents(unittest.TestCase):
+    def test_across_chunks(self):
+        a = ChunkGrid(2, bool, False)
+        a[0:5, 0, 0] = True  # Spans three chunks
+        a[0, 2:4, 0:3] = True  # Separated from the first component by y=1
+        a.ensure_chunk_at_index((3, 3, 3)).set_fill(True)
+
+        labels, count = label_components(a)
+        self.assertEqual(3, count)
+
+        expected, expected_count = ndimage.label(a.to_dense())
+        result = labels.to_dense()
+        self.assertEqual(expected.shape, result.shape)
+        self.assertEqual(expected_count, count)
+        # Same partition, labels may be numbered differently
+        pairs = np.unique(np.stack((expected.ravel(), result.ravel()), axis=1), axis=0)
+        self.assertEqual(count + 1, len(pairs))
+
+    def test_random(self):
+        rng = np.random.default_rng(0)
+        a = ChunkGrid(4, bool, False)
+        a[rng.integers(0, 16, (1500, 3))] = True
+
+        labels, count = label_components(a)
+        expected, expected_count = ndimage.label(a.to_dense())
+        result = labels.to_dense()
+        self.assertEqual(expected_count, count)
+        pairs = np.unique(np.stack((expected.ravel(), result.ravel()), axis=1), axis=0)
+        self.assertEqual(count + 1, len(pairs))
@@ -0,0 +1,16 @@
+import unittest
+
+import numpy as np
+
+from reconstruction.mathlib import morton_code, morton_order
+
+
+class TestMorton(unittest.TestCase):
+    def test_code(self):
+        points = np.array([(0, 0, 0), (0, 0, 1), (0, 1, 0), (1, 0, 0), (1, 1, 1), (2, 0, 0)])
+        self.assertListEqual([0, 1, 2, 4, 7, 32], morton_code(points).tolist())
+
+    def test_order(self):
+        points = [(1, 1, 1), (-1, 0, 0), (0, 0, 0), (-1, 0, -1)]
+        self.assertListEqual([3, 1, 2, 0], morton_order(points).tolist())
+        self.assertEqual(0, len(morton_order([])))
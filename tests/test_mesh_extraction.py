@@ -1,7 +1,7 @@
 import unittest
 
 from reconstruction.mesh_extraction import *
-from reconstruction.mesh_extraction import _detect_cut_edges
+from reconstruction.mesh_extraction import _detect_cut_edges, _corner_cut_edges
 
 
 class TestDilate(unittest.TestCase):
@@ -69,6 +69,18 @@ class TestDilate(unittest.TestCase):
 
         self.assertEqual(str(expected), str(result))
 
+    def test_corner_cut_edges(self):
+        rng = np.random.default_rng(0)
+        sopt = rng.random((5, 5, 5)) < 0.5
+        face_segments = rng.random((5, 5, 5, 6)) < 0.5
+
+        result = _corner_cut_edges(sopt, face_segments)
+
+        for x, y, z in np.ndindex((4, 4, 4)):
+            expected = _detect_cut_edges(sopt[x:x + 2, y:y + 2, z:z + 2], face_segments[x:x + 2, y:y + 2, z:z + 2])
+            for u, v, w in np.ndindex((2, 2, 2)):
+                self.assertEqual(expected[u, v, w], result[u | v << 1 | w << 2, x + u, y + v, z + w])
+
     # def test_real_data_cut_edges_2(self):
     #     block = np.zeros((2, 2, 2), dtype=bool)
     #     block[0, 0, 0] = True